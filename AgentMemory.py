@@ -0,0 +1,141 @@
+import hashlib
+import os
+import re
+
+from langchain.memory import ConversationBufferMemory
+from langchain_core.messages import get_buffer_string
+from langchain_core.tools import Tool
+
+from TokenCounter import estimate_tokens
+
+# 有界上下文模式：AGENT_BOUNDED_CONTEXT=0 时恢复完整观察结果与不限长的记忆
+bounded_context = os.getenv("AGENT_BOUNDED_CONTEXT", "1") not in ("", "0")
+observation_max_chars = int(os.getenv("AGENT_OBSERVATION_MAX_CHARS", "2000"))
+scratchpad_max_tokens = int(os.getenv("AGENT_SCRATCHPAD_TOKENS", "6000"))
+memory_max_tokens = int(os.getenv("AGENT_MEMORY_TOKENS", "2000"))
+default_observation_dir = os.getenv("AGENT_OBSERVATION_DIR", ".agent_observations")
+
+handle_pattern = re.compile(r'obs:[0-9a-f]{12}')
+# compact_observation 生成的省略标记，只有带该标记的文本才复用其中的句柄
+compacted_pattern = re.compile(r'完整内容已保存，句柄 (obs:[0-9a-f]{12})')
+
+
+class ObservationStore:
+    """
+    超长观察结果的磁盘存储，按内容哈希命名，返回形如 obs:xxxxxxxxxxxx 的句柄
+    """
+
+    def __init__(self, directory=default_observation_dir):
+        self.directory = directory
+
+    def path(self, handle):
+        # 句柄来自LLM输出，只接受 obs: 加12位十六进制，防止拼接出目录外的路径
+        if not handle_pattern.fullmatch(handle):
+            raise ValueError(f"invalid observation handle: {handle}")
+        return os.path.join(self.directory, handle.split(':', 1)[1] + '.txt')
+
+    def save(self, text):
+        handle = 'obs:' + hashlib.sha1(text.encode('utf-8')).hexdigest()[:12]
+        path = self.path(handle)
+        if not os.path.exists(path):
+            os.makedirs(self.directory, exist_ok=True)
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(text)
+        return handle
+
+    def load(self, handle, start=0, length=None):
+        """
+        :return: 从start开始的length个字符，句柄无效或不存在时返回None
+        """
+        try:
+            with open(self.path(handle), 'r', encoding='utf-8') as f:
+                text = f.read()
+        except (FileNotFoundError, ValueError):
+            return None
+        return text[start:start + length] if length else text[start:]
+
+
+observation_store = ObservationStore()
+
+
+def compact_observation(text, store=observation_store, max_chars=None):
+    """
+    超过max_chars的观察结果完整保存到磁盘，返回开头和结尾的摘录以及句柄（省略标记需与compacted_pattern一致）
+    """
+    max_chars = max_chars or observation_max_chars
+    text = str(text)
+    if len(text) <= max_chars:
+        return text
+    handle = store.save(text)
+    head = text[:max_chars * 2 // 3]
+    tail = text[-(max_chars // 3):]
+    return (f"{head}\n...<省略{len(text) - len(head) - len(tail)}字符，完整内容已保存，句柄 {handle}，"
+            f"可使用ReadObservation工具分段查看>...\n{tail}")
+
+
+def bounded_tool(tool, store=observation_store, max_chars=None):
+    """
+    包装Agent工具，使其返回的超长观察结果自动压缩为摘录加句柄；工具名称和描述保持不变
+    """
+    def run(tool_input):
+        return compact_observation(tool.run(tool_input), store, max_chars)
+
+    return Tool(name=tool.name, description=tool.description, func=run)
+
+
+class ScratchpadWindow:
+    """
+    AgentExecutor 的 trim_intermediate_steps：只保留最近keep_recent步的完整观察结果，
+    更早的超过max_chars的观察结果替换为首行和句柄，较短的保持原样；总量仍超过max_tokens时丢弃最早的步骤，
+    使每轮迭代的提示词长度保持平稳而不随迭代次数增长
+    """
+
+    def __init__(self, max_tokens=None, keep_recent=2, store=observation_store, max_chars=None):
+        self.max_tokens = max_tokens or scratchpad_max_tokens
+        self.keep_recent = keep_recent
+        self.store = store
+        self.max_chars = max_chars or observation_max_chars
+
+    def summarize(self, observation):
+        text = str(observation)
+        if len(text) <= self.max_chars:
+            return observation
+        # 已由compact_observation压缩过的结果直接沿用其句柄，其他文本中出现的句柄（如“未找到句柄 obs:…”）不可信
+        match = compacted_pattern.search(text)
+        handle = match.group(1) if match else self.store.save(text)
+        first_line = text.strip().split('\n', 1)[0][:200]
+        return f"{first_line} ...<较早的观察结果已省略，句柄 {handle}>"
+
+    def step_tokens(self, step):
+        action, observation = step
+        return estimate_tokens(action.log) + estimate_tokens(str(observation))
+
+    def __call__(self, intermediate_steps):
+        steps = list(intermediate_steps)
+        cutoff = len(steps) - self.keep_recent
+        steps = [(action, self.summarize(observation)) if index < cutoff else (action, observation)
+                 for index, (action, observation) in enumerate(steps)]
+        total = sum(self.step_tokens(step) for step in steps)
+        while len(steps) > self.keep_recent and total > self.max_tokens:
+            total -= self.step_tokens(steps.pop(0))
+        return steps
+
+
+class TokenWindowMemory(ConversationBufferMemory):
+    """
+    按token数截断的对话记忆：超过max_token_limit时从最早的消息开始丢弃，使用本地token估算，不依赖具体模型
+    """
+
+    max_token_limit: int = 2000
+
+    def save_context(self, inputs, outputs):
+        super().save_context(inputs, outputs)
+        messages = self.chat_memory.messages
+        while len(messages) > 2 and estimate_tokens(get_buffer_string(messages)) > self.max_token_limit:
+            messages.pop(0)
+
+
+def create_memory():
+    if bounded_context:
+        return TokenWindowMemory(max_token_limit=memory_max_tokens)
+    return ConversationBufferMemory()
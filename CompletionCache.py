@@ -0,0 +1,138 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+default_cache_path = os.getenv("LLM_CACHE_PATH", ".llm_cache/completions.sqlite3")
+
+
+class CompletionCache:
+    """
+    LLM补全结果的本地持久化缓存
+    以 (model, messages, temperature) 的哈希为键存放在SQLite文件中，
+    相同提示词重复运行时直接返回缓存结果，不再请求接口
+    """
+
+    def __init__(self, path=default_cache_path, max_bytes=512 * 1024 * 1024, max_age_days=30, bypass=None,
+                 evict_every=100):
+        """
+        :param path: SQLite缓存文件路径
+        :param max_bytes: 缓存内容总大小上限，超出时按最近访问时间淘汰
+        :param max_age_days: 缓存有效天数，过期条目视为未命中并被淘汰
+        :param bypass: 为True时跳过读缓存（仍写入新结果），默认读取环境变量LLM_CACHE_BYPASS
+        :param evict_every: 每写入多少条执行一次淘汰
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age = max_age_days * 24 * 3600
+        if bypass is None:
+            bypass = os.getenv("LLM_CACHE_BYPASS", "") not in ("", "0")
+        self.bypass = bypass
+        self.evict_every = evict_every
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.lock = threading.Lock()
+        self.conn = None
+
+    def connect(self):
+        if self.conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self.conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            # WAL模式下提交无需每次整库同步，命中时更新访问时间的开销可忽略
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS completions (
+                    key TEXT PRIMARY KEY,
+                    model TEXT,
+                    content TEXT,
+                    size INTEGER,
+                    created_at REAL,
+                    accessed_at REAL
+                )""")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_accessed_at ON completions (accessed_at)")
+            self.conn.commit()
+        return self.conn
+
+    @staticmethod
+    def make_key(model, messages, temperature=None):
+        payload = json.dumps({"model": model, "messages": messages, "temperature": temperature},
+                             ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        if self.bypass:
+            self.misses += 1
+            return None
+        now = time.time()
+        with self.lock:
+            conn = self.connect()
+            row = conn.execute("SELECT content, created_at FROM completions WHERE key = ?", (key,)).fetchone()
+            if row is None or now - row[1] > self.max_age:
+                self.misses += 1
+                return None
+            conn.execute("UPDATE completions SET accessed_at = ? WHERE key = ?", (now, key))
+            conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def set(self, key, model, content):
+        if content is None:
+            return
+        now = time.time()
+        with self.lock:
+            conn = self.connect()
+            conn.execute("INSERT OR REPLACE INTO completions VALUES (?, ?, ?, ?, ?, ?)",
+                         (key, model, content, len(content.encode('utf-8')), now, now))
+            conn.commit()
+            self.writes += 1
+            if self.writes % self.evict_every == 0:
+                self.evict_locked()
+
+    def delete(self, key):
+        """
+        删除一条缓存，用于丢弃事后判定为无效的补全结果
+        """
+        with self.lock:
+            conn = self.connect()
+            conn.execute("DELETE FROM completions WHERE key = ?", (key,))
+            conn.commit()
+
+    def evict(self):
+        with self.lock:
+            self.evict_locked()
+
+    def evict_locked(self):
+        conn = self.connect()
+        # 先淘汰过期条目
+        conn.execute("DELETE FROM completions WHERE created_at < ?", (time.time() - self.max_age,))
+        # 总大小超出上限时，按最近访问时间从旧到新淘汰
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM completions").fetchone()[0]
+        if total > self.max_bytes:
+            expired = []
+            for key, size in conn.execute("SELECT key, size FROM completions ORDER BY accessed_at"):
+                if total <= self.max_bytes:
+                    break
+                expired.append((key,))
+                total -= size
+            conn.executemany("DELETE FROM completions WHERE key = ?", expired)
+        conn.commit()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+            'writes': self.writes,
+            'bypass': self.bypass,
+        }
+
+
+completion_cache = CompletionCache()
+
@@ -1,23 +1,30 @@
-from langchain_openai import ChatOpenAI 
 from langchain.agents import create_react_agent,  AgentExecutor,tool
 from langchain_core.prompts import PromptTemplate
-from langchain.memory import ConversationBufferMemory,ConversationSummaryMemory 
-from openai import OpenAI
+import argparse
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import pandas as pd
 import json
 import ast
-import subprocess
 import re
+from CompletionCache import completion_cache
+from LLMGateway import llm_gateway
+from LogInjector import inject_log_statements_file, log_injection_mode
+from LogSelection import compact_selected_logs, select_logs_by_coverage
+from AgentMemory import (ScratchpadWindow, bounded_context, bounded_tool, create_memory, observation_max_chars,
+                         observation_store)
+from Tracing import ToolTracingCallback, tracer
+from QTADigest import digest_and_save, output_digest
+from QTAValidator import preflight_message
+from QTARunner import qta_result_cache, qta_worker_pool, run_test_module, to_test_module
 # 从环境变量中获取 API key
-llm_model = ChatOpenAI(
-    model="gpt-4o-2024-08-06",
-    temperature=0.2,
-    max_tokens=1000,
-    api_key=os.getenv("OPENAI_API_KEY"),
-    base_url="https://api.chatanywhere.tech/v1"
-)
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"),base_url="https://api.chatanywhere.tech/v1")
+# 所有LLM请求都经过共享的 llm_gateway：同一个连接池、统一的超时重试与并发上限，并按调用位置统计
+llm_model = llm_gateway.chat_model(site="agent")
+fixer_llm_model = llm_gateway.chat_model(site="QTALLMFixer")
+# FindLog预算模式：每个URL最多保留的日志条数、单个字符串值的最大长度，均设为0时按原样输出全部日志
+select_log_max_per_url = int(os.getenv("SELECT_LOG_MAX_PER_URL", "2"))
+select_log_max_chars = int(os.getenv("SELECT_LOG_MAX_CHARS", "500"))
 template = '''
             Answer the following questions by Chinese as best you can. You have access to the following tools:
             Please note that when calling the tool during this process, the Action Input can only be a string or a list; other data structures cannot be used. For example, you can only select `'datasets/1/merged.csv'` or `'datasets/1/testcase.txt'`.
@@ -48,25 +55,36 @@ template = '''
 
 #*****************************************************************************************************************************************************************#
 
-def chat(content=""):
+chat_model_name = "gpt-4o-2024-08-06"
+
+
+def chat_messages(content):
+    return [{"role": "system", "content": "You are an assistant."},
+            {"role": "user", "content": content}]
+
+
+def discard_chat(content):
+    """
+    丢弃该提示词缓存的补全结果：返回的代码未通过静态检查时调用，否则重试会一直拿到同一份缓存的错误代码
+    """
+    llm_gateway.invalidate(chat_messages(content), chat_model_name)
+
+
+def chat(content="", site="chat"):
         """
         GPT接口
         :param content: 输入的问题内容，若为空则函数直接返回
+        :param site: 调用位置，用于按工具统计LLM耗时与token用量
         :return: 以 JSON 格式返回服务器的响应
         """
         try:
-            chat_response = client.chat.completions.create(
-                model="gpt-4o-2024-08-06",  # 确保使用正确的模型
-                messages=[{"role": "system", "content": "You are an assistant."},
-                          {"role": "user", "content": content}]
+            # 相同提示词命中本地缓存时不再请求接口，设置LLM_CACHE_BYPASS=1可强制重新请求
+            return llm_gateway.complete(
+                model=chat_model_name,  # 确保使用正确的模型
+                messages=chat_messages(content),
+                site=site
             )
 
-            # 确保响应和choices存在且非空
-            if chat_response and chat_response.choices:
-                return chat_response.choices[0].message.content
-            else:
-                raise ValueError("Received an empty response from the API.")
-
         except Exception as e:
             print(f"Error during chat completion: {e}")
             return None
@@ -110,6 +128,61 @@ def parse_json(json_str, key_list):
                     return result
 
     return extract(data, key_list)  
+
+def build_key_index(data):
+    """
+    单次遍历解析后的数据，得到每个键在 parse_json 中会被取到的值
+    :param data: 解析后的JSON数据
+    :return: 键 -> 值 的字典，只包含非None的值；对任意键k，结果与 parse_json(json_str, [k]) 一致
+    """
+    index = {}
+    if isinstance(data, dict):
+        blocked = set()  # 在当前字典中值为None的键，parse_json会就此停止在当前字典中的查找
+        for key, value in data.items():
+            if key not in index and key not in blocked:
+                if value is None:
+                    blocked.add(key)
+                else:
+                    index[key] = value
+            for sub_key, sub_value in build_key_index(value).items():
+                if sub_key not in index and sub_key not in blocked:
+                    index[sub_key] = sub_value
+    elif isinstance(data, list):
+        for item in data:
+            for sub_key, sub_value in build_key_index(item).items():
+                index.setdefault(sub_key, sub_value)
+    return index
+
+class FieldIndex:
+    """
+    日志单元格的字段索引
+    每个单元格只解析、遍历一次，之后所有字段都从键索引中直接取值
+    """
+    def __init__(self):
+        self.cells = {}
+
+    def lookup(self, cell, field):
+        if not isinstance(cell, str):
+            return None  # 空单元格（如GET请求没有请求体）
+        index = self.cells.get(cell)
+        if index is None:
+            try:
+                data = json.loads(cell.replace("'", "\""))
+            except json.JSONDecodeError:
+                data = ast.literal_eval(cell)
+            index = self.cells[cell] = build_key_index(data)
+        return index.get(field)
+
+# cleaned.csv路径 -> (修改时间, 文件大小, FieldIndex)，同一份日志重复调用FindLog时复用
+field_index_cache = {}
+
+def get_field_index(cleaned_path):
+    stat = os.stat(cleaned_path)
+    key = os.path.abspath(cleaned_path)
+    cached = field_index_cache.get(key)
+    if cached is None or cached[:2] != (stat.st_mtime_ns, stat.st_size):
+        cached = field_index_cache[key] = (stat.st_mtime_ns, stat.st_size, FieldIndex())
+    return cached[2]
   
 def find_and_extract_fields(api_des_path,cleaned_path, possible_fields):
     """
@@ -121,16 +194,17 @@ def find_and_extract_fields(api_des_path,cleaned_path, possible_fields):
     api_des = pd.read_csv(api_des_path)#第一个参数是接口集路径，第二个参数是原始日志路径
     cleaned = pd.read_csv(cleaned_path)
     unique_URLs = api_des['URL'].drop_duplicates().tolist()
-    df= cleaned[cleaned['URL'].isin(unique_URLs)]
+    df= cleaned[cleaned['URL'].isin(unique_URLs)].copy()
+    field_index = get_field_index(cleaned_path)
     for field in possible_fields:
         # 从 'Request' 列中提取字段
-        df[field] = df['Request'].apply(lambda x: parse_json(x, [field]))
+        df[field] = df['Request'].map(lambda x: field_index.lookup(x, field))
         
         # 如果 'Request' 中没有找到，则从 'Response' 列中提取字段
-        df[field] = df.apply(
-            lambda row: parse_json(row['Response'], [field]) if row[field] is None else row[field],
-            axis=1
-        )
+        df[field] = [
+            field_index.lookup(response, field) if value is None else value
+            for value, response in zip(df[field], df['Response'])
+        ]
     
     return df
 
@@ -194,32 +268,19 @@ def sort_and_select_logs(df,api_des_path):
             if covered_URLs >= api_URLs:
                 break
     return selected_logs
-def run_QTA_and_return_result(input_test_file: str) -> str:
+def run_QTA_and_return_result(input_test_file: str, force: bool = False) -> str:
     """
     ## 工具描述:执行指定的 QTA 测试用例文件，并返回测试结果。
     ##示例输入格式："/path/to/test_n.py"
     :param input_test_file: QTA接口测试用例文件的路径。
+    :param force: 为True时忽略执行结果缓存，强制重新执行
     :return: 测试结果的输出内容
     """
-    input_test_file=input_test_file.strip('"').strip("'").strip().replace('"', '').replace("'", '').replace("/", ".")
-    match = re.search(r'\.([^.]+)\.([^.]+)\.py$', input_test_file)
+    test_module = to_test_module(input_test_file)
 
-    input_test_file = f"{match.group(1)}.{match.group(2)}"
-
-    # 运行 QTA 并获取输出结果
-    command = 'python '+'medtesttestproj/manage.py '+'runtest '+input_test_file
-    try:
-        # 通过 subprocess 运行命令并捕获输出，指定编码为 utf-8
-        result = subprocess.run(command, capture_output=True, text=True, check=True, shell=True, encoding='utf-8', errors='replace')
-
-        # 将标准输出和标准错误保存为字符串
-        output = result.stdout  # 标准输出
-        #error_output = result.stderr  # 标准错误
-        #print(output)
-        return output  # 返回输出和错误输出作为字符串
-    except subprocess.CalledProcessError as e:
-        # 如果命令失败，捕获并返回错误信息
-        return e.stdout  # 返回捕获到的输出和错误信息
+    # 运行 QTA 并获取输出结果，默认由常驻测试进程执行，输出与 manage.py runtest 相同；
+    # 用例源码与 MedTestlib 未变化时直接返回缓存的结果
+    return run_test_module(test_module, force=force)
 
 def get_url_and_steps(csv_path):
     # 读取 CSV 文件
@@ -258,9 +319,21 @@ def AddLogStatements(input_string: str) -> str:
     if not os.path.exists(qta_code_path):
         return f"无法找到 QTA 测试用例路径 {qta_code_path}"
 
+    # 默认在本地按语法树插入日志语句，无需请求LLM；代码无法解析或找不到接口调用时再交给LLM处理
+    inserted = None
+    if log_injection_mode != "llm":
+        try:
+            inserted = inject_log_statements_file(qta_code_path)
+        except SyntaxError:
+            inserted = None
+        if inserted:
+            return f"已在 QTA 测试用例中加入{inserted}条日志打印语句，更新后的代码已保存到: {qta_code_path} 中。"
+
     with open(qta_code_path, 'r', encoding='utf-8') as file:
         qta_code_content = file.read()
     #print( qta_code_content)
+    if inserted == 0 and "Response Body" in qta_code_content:
+        return f"QTA 测试用例中的接口调用已有日志打印语句，无需修改: {qta_code_path}"
     # 创建 LLM 提示以插入日志打印语句
     prompt = f"""
     ### 在 QTA 测试用例代码中加入日志打印语句
@@ -277,8 +350,12 @@ def AddLogStatements(input_string: str) -> str:
     """
     #print(prompt)
     # 使用 LLM 生成插入日志后的代码
-    response = chat(prompt)
+    response = chat(prompt, site="AddLogStatements")
     QTA_code=extract_llm_test(response)
+    rejected = preflight_message(QTA_code, qta_code_path)
+    if rejected:
+        discard_chat(prompt)
+        return rejected
     # 保存更新后的代码
     with open(qta_code_path, 'w', encoding='utf-8') as file:
         file.write(QTA_code)
@@ -341,7 +418,7 @@ def FindPossibleFieldsByLLM(input_string:str) -> str:
 
 
         # 调用 chat 函数，生成响应
-        response = chat(prompt)
+        response = chat(prompt, site="FindPossibleFieldsByLLM")
         return response
     
     except FileNotFoundError as e:
@@ -389,50 +466,56 @@ def FindLog(input_string:str)->str:
     possible_fields = ast.literal_eval(list_string)
     print(possible_fields)
     df = find_and_extract_fields(api_des_path,cleaned_path, possible_fields)
-    selected_logs = sort_and_select_logs(df, api_des_path)
+    # 按依赖字段分组后用贪心集合覆盖挑选日志，旧的 sort_and_select_logs 仍保留用于对比
+    selected_logs = select_logs_by_coverage(df, api_des_path)
     
     # 获取 api_des_path 的目录
     directory = os.path.dirname(api_des_path)
 
     # 在同一目录下创建 select_log.txt 并写入日志
     select_log_path = os.path.join(directory, "select_log.txt")
+    if not select_log_max_per_url and not select_log_max_chars:
+        with open(select_log_path, 'w', encoding='utf-8') as file:
+            file.write(str(selected_logs))
+        return f"日志已存储在: {select_log_path}"
+
+    # 预算模式：限制每个URL的日志条数并截断过长的字段值，以紧凑的JSON Lines写入
+    log_text, stats = compact_selected_logs(selected_logs, select_log_max_per_url, select_log_max_chars)
     with open(select_log_path, 'w', encoding='utf-8') as file:
-        file.write(str(selected_logs))
+        file.write(log_text)
+    saved_bytes = stats['original_bytes'] - stats['bytes']
+    saved_tokens = stats['original_tokens'] - stats['tokens']
+    print(f"select_log压缩统计: {stats}")
 
     # 返回日志文件的路径
-    return f"日志已存储在: {select_log_path}"
+    return (f"日志已存储在: {select_log_path}（保留{stats['kept_logs']}/{stats['logs']}条日志，"
+            f"节省{saved_bytes}字节、约{saved_tokens} tokens）")
 
 
 
 @tool
 def RunQTACode(input_test_file: str) -> str:
     """
-    ## 工具描述:执行指定的 QTA 测试用例文件，并返回测试结果。
-    ##示例输入格式："/path/to/test_n.py"
+    ## 工具描述:执行指定的 QTA 测试用例文件，并返回测试结果摘要（各步骤结果、HTTP状态码、返回体摘录、失败的断言和异常），
+    ## 完整输出保存在摘要末尾给出的日志文件中。用例代码未修改时会直接返回上次的执行结果，
+    ## 如需重新请求接口（例如怀疑接口状态已变化），在路径后加上 --force
+    ##示例输入格式："/path/to/test_n.py" 或 "/path/to/test_n.py --force"
     :param input_test_file: QTA接口测试用例文件的路径。
     :return: 测试结果的输出内容
     """
-    input_test_file=input_test_file.strip('"').strip("'").strip().replace('"', '').replace("'", '').replace("/", ".")
-    match = re.search(r'\.([^.]+)\.([^.]+)\.py$', input_test_file)
-    if match:
-        input_test_file = f"{match.group(1)}.{match.group(2)}"
-    else:
+    force = '--force' in input_test_file
+    test_module = to_test_module(input_test_file.replace('--force', ''))
+    if test_module is None:
         return "输入路径不正确未找到对应的 .py 文件"
    
-    # 运行 QTA 并获取输出结果
-    command = 'python '+'medtesttestproj/manage.py '+'runtest '+input_test_file
-    try:
-        # 通过 subprocess 运行命令并捕获输出，指定编码为 utf-8
-        result = subprocess.run(command, capture_output=True, text=True, check=True, shell=True, encoding='utf-8', errors='replace')
-
-        # 将标准输出和标准错误保存为字符串
-        output = result.stdout  # 标准输出
-        #error_output = result.stderr  # 标准错误
-        print(output)
-        return output  # 返回输出和错误输出作为字符串
-    except subprocess.CalledProcessError as e:
-        # 如果命令失败，捕获并返回错误信息
-        return e.stdout  # 返回捕获到的输出和错误信息
+    # 运行 QTA 并获取输出结果，默认由常驻测试进程执行，输出与 manage.py runtest 相同；
+    # 用例源码与 MedTestlib 未变化时直接返回缓存的结果
+    output = run_test_module(test_module, force=force)
+    print(output)
+    if output_digest:
+        # 返回体日志等完整输出写入磁盘，只把摘要作为观察结果交给Agent
+        return digest_and_save(test_module, output)
+    return output
 
 @tool
 def GenerateQTATestcase(input_string: str)->str:
@@ -577,8 +660,13 @@ def GenerateQTATestcase(input_string: str)->str:
             - 日志：
             {logs}     
 """
-    response=chat(prompt)
+    response=chat(prompt, site="GenerateQTATestcase")
     QTA_code=extract_llm_test(response)
+    # 写入前静态检查，无法编译或缺少QTA用例结构的代码不写入文件，省去一次用例执行
+    rejected = preflight_message(QTA_code, response_path)
+    if rejected:
+        discard_chat(prompt)
+        return rejected
     
     dir_name = os.path.dirname(response_path)
     if dir_name:  # 防止路径为空或为当前目录
@@ -591,6 +679,57 @@ def GenerateQTATestcase(input_string: str)->str:
 
     """
 
+@tool
+def ReadObservation(input_string: str) -> str:
+    """
+    ## 工具描述:查看被省略的完整观察结果。工具返回的内容过长时只会显示摘录和句柄（形如 obs:0123456789ab），可用本工具按需分段查看原文。
+    ## 输入变量说明：
+    传入变量为`input_string`，包含以下内容，使用空格分隔：
+    1. 句柄（`handle`），
+    2. 可选，起始字符位置（`start`），默认0，
+    3. 可选，查看的字符数（`length`），默认且最多2000，
+
+    示例输入格式："obs:0123456789ab 2000 2000"
+    """
+    parts = input_string.strip().strip('"').strip("'").split()
+    if not parts:
+        return "请输入句柄，例如 obs:0123456789ab"
+    start = int(parts[1]) if len(parts) > 1 and parts[1].isdigit() else 0
+    # 每次最多返回observation_max_chars个字符，与其他工具的观察结果长度上限一致
+    length = min(int(parts[2]) if len(parts) > 2 and parts[2].isdigit() else observation_max_chars,
+                 observation_max_chars)
+    text = observation_store.load(parts[0], start, length)
+    if text is None:
+        return f"未找到句柄 {parts[0]} 对应的内容"
+    return text
+
+
+def build_agent_executor(llm, tools, prompt_template, max_iterations=10, verbose=True):
+    """
+    创建ReAct AgentExecutor
+    有界上下文模式（默认开启，AGENT_BOUNDED_CONTEXT=0关闭）下：超长观察结果保存到磁盘并以摘录加句柄代替，
+    并提供ReadObservation工具按需查看；草稿区只保留最近几步的完整观察结果；记忆按token数截断
+    """
+    memory = create_memory()
+    options = {}
+    if bounded_context:
+        tools = [bounded_tool(item) for item in tools] + [ReadObservation]
+        options['trim_intermediate_steps'] = ScratchpadWindow()
+    # 创建Agent 
+    agent = create_react_agent(llm, tools, prompt_template)
+    ##创建 AgentExecutor
+    return AgentExecutor(
+        agent=agent,
+        tools=tools,
+        memory=memory,
+        verbose=verbose,
+        handle_parsing_errors=True,
+        output_key="output" ,
+        max_iterations=max_iterations,
+        **options
+    )
+
+
 @tool
 def QTALLMFixer(input_string: str) -> str:
     """
@@ -643,19 +782,9 @@ def QTALLMFixer(input_string: str) -> str:
     """
 
     # 使用 React Agent 生成修复后的代码
-    memory = ConversationBufferMemory()
-    agent = create_react_agent(llm_model, tools, prompt_template)
-    agent_executor = AgentExecutor(
-        agent=agent,
-        tools=tools,
-        memory=memory,
-        verbose=True,
-        handle_parsing_errors=True,
-        output_key="output",
-        max_iterations=6
-    )
+    agent_executor = build_agent_executor(fixer_llm_model, tools, prompt_template, max_iterations=6)
     
-    ans = agent_executor.invoke(user_input_dict)["output"]
+    ans = agent_executor.invoke({"input": prompt}, config={"callbacks": [ToolTracingCallback()]})["output"]
     if ans!="Agent stopped due to iteration limit or time limit.":
         return ans
     return "LLM修复器达到最大迭代次数,测试用例不确定是否已被完全修复,请通过运行验证修复验证结果"
@@ -720,7 +849,7 @@ def CheckTestCaseCompliance(input_string: str) -> str:
         
 """
 
-    response = chat(prompt)
+    response = chat(prompt, site="CheckTestCaseCompliance")
     return response
 
 
@@ -798,8 +927,12 @@ def ImproveAssertionQuality(input_string: str) -> str:
         """
 
 
-    response = chat(prompt)
+    response = chat(prompt, site="ImproveAssertionQuality")
     QTA_code=extract_llm_test(response)
+    rejected = preflight_message(QTA_code, qta_code_path)
+    if rejected:
+        discard_chat(prompt)
+        return rejected
     # 保存更新后的代码
     with open(qta_code_path, 'w', encoding='utf-8') as file:
         file.write(QTA_code)
@@ -958,8 +1091,12 @@ def FixResponseError(input_string: str)->str:
 
         """
 
-    response=chat(prompt)
+    response=chat(prompt, site="FixResponseError")
     QTA_code=extract_llm_test(response)
+    rejected = preflight_message(QTA_code, QTA_code_path)
+    if rejected:
+        discard_chat(prompt)
+        return rejected
     
     dir_name = os.path.dirname(QTA_code_path)
     if dir_name:  # 防止路径为空或为当前目录
@@ -972,70 +1109,139 @@ def FixResponseError(input_string: str)->str:
     """
 
 
+
+def build_user_input(data_URL, test_code_path):
+    """
+    构造单个数据集的Agent输入
+    :param data_URL: 数据集目录，如 "datasets/1"
+    :param test_code_path: 该数据集生成的测试用例存放路径
+    """
+    log_path = f'{data_URL}/cleaned.csv'
+    merge_path = f'{data_URL}/merged.csv'
+    testcase_path=f"{data_URL}/testcase.txt"
+
+    with open(testcase_path, 'r', encoding='utf-8') as file:
+            testcase = file.read()
+
+    return {
+        "input": f'''
+                根据以下文本用例，接口集，以及原始日志生成QTA测试用例.
+                
+                ##文本用例：
+                {testcase}
+                ##文件存放路径
+                # 请牢记以下文件存放路径！！避免产生幻觉！
+                原始日志集存放路径为:"{log_path}"
+                接口集csv文件存放路径为:"{merge_path}"
+                请牢记接口测试用例文件存放路径！！接口测试用例文件存放路径为，这可以给你暂时存放已生成的测试用例:"{test_code_path}"
+                文本用例存放路径为:"{testcase_path}"
+
+                ##注意
+                # 原始日志集体积过大，你应该首先使用各种tool提取原始日志中的有效信息找到有效小体量的日志再去生成测试用例
+                # 当调用工具GenerateQTATestcase时,对应生成的QTA接口测试用例就会被保存在接口测试用例文件存放路径之中,
+                # 你的tool的性质可分成两类，一类是帮助你获取生成测试用例所需要的信息，一类是让你验证使用工具后得到的信息是否准确。
+                # 如果发现生成的测试用例存在运行错误或者断言错误需要打回重新生成
+                ！
+
+                ## 特别注意！！！
+                在生成测试用例后，请使用相应的工具或者利用你的专业知识对生成的测试用例进行检查，确保以下几点：
+                1. 参数准确性：检查关联参数的准确性。
+                2. 运行验证：确认生成的测试用例能够成功运行,最后交给我的测试用例必须可以被正确运行，且结果正确。
+                3. 断言准确性：获取代码具体内容并仔细检查测试代码中的断言，确保其准确且能够反映依赖参数在代码中的流转以及断言高度准确，符合文本用例场景要求。
+                4.If you find that the QTA generated by the tools is incorrect, you cannot modify it yourself and need to rely on the tools to regenerate it.
+                测试用例运行正确并不代表断言一定准确，务必进行全面的验证
+                
+                ##Final Answer格式：
+                Final Answer: The final answer to the original input question, verified by the QTA result, is as follows:......
+
+                
+                '''
+    }
+
+
+def create_agent_executor(tools, prompt_template, verbose=True):
+    """
+    每个会话使用独立的记忆与AgentExecutor，会话之间不共享上下文
+    """
+    return build_agent_executor(llm_model, tools, prompt_template, max_iterations=10, verbose=verbose)
+
+
+def run_agent_session(dataset_id, tools, prompt_template, data_root="datasets/", verbose=True):
+    """
+    为单个数据集执行一次完整的Agent会话，异常只记录在结果中，不影响其他数据集
+    :return: 会话结果字典，status 为 success/stopped/failed，stopped 表示达到迭代次数上限
+    """
+    data_URL = data_root + str(dataset_id)
+    test_code_path = f"medtesttestproj/MedTesttest/test_{dataset_id}.py"
+    start = time.perf_counter()
+    # 本会话的工具调用、LLM请求与用例执行都记录到 traces/<数据集>.jsonl
+    with tracer.dataset(dataset_id), tracer.span('agent_session', kind='session') as span:
+        try:
+            user_input_dict = build_user_input(data_URL, test_code_path)
+            agent_executor = create_agent_executor(tools, prompt_template, verbose)
+            result = agent_executor.invoke(user_input_dict, config={"callbacks": [ToolTracingCallback()]})
+            output = result.get("output", "")
+            status = 'stopped' if output.startswith("Agent stopped") else 'success'
+        except Exception as e:
+            output = f"{type(e).__name__}: {e}"
+            status = 'failed'
+        span['attributes']['session_status'] = status
+    return {
+        'dataset': dataset_id,
+        'status': status,
+        'seconds': round(time.perf_counter() - start, 2),
+        'test_code_path': test_code_path,
+        'output': output,
+    }
+
+
+def run_agent_sessions(dataset_ids, tools, prompt_template, data_root="datasets/", concurrency=4, rate=None,
+                       verbose=True):
+    """
+    使用线程池并发执行多个数据集的Agent会话
+    :param concurrency: 同时进行的会话数，同时也是常驻QTA测试进程数
+    :param rate: 所有会话合计每秒最多发起的LLM请求数，为空时不限速
+    :return: 按数据集顺序排列的会话结果列表
+    """
+    llm_gateway.set_rate(rate)
+    qta_worker_pool.resize(concurrency)
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=max(concurrency, 1)) as executor:
+        futures = {executor.submit(run_agent_session, dataset_id, tools, prompt_template, data_root, verbose):
+                   dataset_id for dataset_id in dataset_ids}
+        for future in as_completed(futures):
+            result = future.result()
+            results[futures[future]] = result
+            print(f"数据集{result['dataset']}会话结束: {result['status']}，耗时{result['seconds']}s")
+    return [results[dataset_id] for dataset_id in dataset_ids]
+
+
+def print_session_summary(results):
+    print("\n========== Agent会话汇总 ==========")
+    for result in results:
+        print(f"数据集{result['dataset']}\t{result['status']}\t{result['seconds']}s\t{result['test_code_path']}")
+        if result['status'] != 'success':
+            print(f"    {result['output'][:200]}")
+
+
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="并发为多个数据集生成QTA接口测试用例")
+    parser.add_argument('--datasets', nargs='+', default=['1', '2', '3'], help="要处理的数据集编号")
+    parser.add_argument('--data-root', default="datasets/", help="数据集根目录")
+    parser.add_argument('--concurrency', type=int, default=4, help="同时进行的Agent会话数")
+    parser.add_argument('--rate', type=float, default=None, help="所有会话合计每秒最多发起的LLM请求数")
+    parser.add_argument('--quiet', action='store_true', help="不打印Agent的中间推理过程")
+    args = parser.parse_args()
+
     # 创建工具列表
     tools = [RunQTACode,FindPossibleFieldsByLLM,FindLog,GenerateQTATestcase,QTALLMFixer]
     #tool_names = ", ".join([tool.name for tool in tools])
     # 创建提示模板
     prompt_template = PromptTemplate.from_template(template)
-    for i in range(1,4):
-        data_root="datasets/"
-        data_URL = data_root + str(i)
-        log_path = f'{data_URL}/cleaned.csv'
-        merge_path = f'{data_URL}/merged.csv'
-        testcase_path=f"{data_URL}/testcase.txt"
-        test_code_path = f"medtesttestproj/MedTesttest/test_{i}.py"
-
-        with open(testcase_path, 'r', encoding='utf-8') as file:
-                testcase = file.read()
-
-        user_input_dict = {
-            "input": f'''
-                    根据以下文本用例，接口集，以及原始日志生成QTA测试用例.
-                    
-                    ##文本用例：
-                    {testcase}
-                    ##文件存放路径
-                    # 请牢记以下文件存放路径！！避免产生幻觉！
-                    原始日志集存放路径为:"{log_path}"
-                    接口集csv文件存放路径为:"{merge_path}"
-                    请牢记接口测试用例文件存放路径！！接口测试用例文件存放路径为，这可以给你暂时存放已生成的测试用例:"{test_code_path}"
-                    文本用例存放路径为:"{testcase_path}"
-
-                    ##注意
-                    # 原始日志集体积过大，你应该首先使用各种tool提取原始日志中的有效信息找到有效小体量的日志再去生成测试用例
-                    # 当调用工具GenerateQTATestcase时,对应生成的QTA接口测试用例就会被保存在接口测试用例文件存放路径之中,
-                    # 你的tool的性质可分成两类，一类是帮助你获取生成测试用例所需要的信息，一类是让你验证使用工具后得到的信息是否准确。
-                    # 如果发现生成的测试用例存在运行错误或者断言错误需要打回重新生成
-                    ！
-
-                    ## 特别注意！！！
-                    在生成测试用例后，请使用相应的工具或者利用你的专业知识对生成的测试用例进行检查，确保以下几点：
-                    1. 参数准确性：检查关联参数的准确性。
-                    2. 运行验证：确认生成的测试用例能够成功运行,最后交给我的测试用例必须可以被正确运行，且结果正确。
-                    3. 断言准确性：获取代码具体内容并仔细检查测试代码中的断言，确保其准确且能够反映依赖参数在代码中的流转以及断言高度准确，符合文本用例场景要求。
-                    4.If you find that the QTA generated by the tools is incorrect, you cannot modify it yourself and need to rely on the tools to regenerate it.
-                    测试用例运行正确并不代表断言一定准确，务必进行全面的验证
-                    
-                    ##Final Answer格式：
-                    Final Answer: The final answer to the original input question, verified by the QTA result, is as follows:......
-
-                    
-                    '''
-        }
-        memory = ConversationBufferMemory()
-        # 创建Agent 
-        agent = create_react_agent(llm_model, tools, prompt_template)
-        ##创建 AgentExecutor
-        agent_executor = AgentExecutor(
-            agent=agent,
-            tools=tools,
-            memory=memory,
-            verbose=True,
-            handle_parsing_errors=True,
-            output_key="output" ,
-            max_iterations=10 
-        )
-        agent_executor.invoke(user_input_dict)
-
-
+    session_results = run_agent_sessions(args.datasets, tools, prompt_template, args.data_root,
+                                         args.concurrency, args.rate, not args.quiet)
+    print_session_summary(session_results)
+    print(f"LLM缓存统计: {completion_cache.stats()}")
+    llm_gateway.metrics.print_summary()
+    print(f"用例执行结果缓存统计: {qta_result_cache.stats()}")
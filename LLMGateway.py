@@ -0,0 +1,491 @@
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+
+import httpx
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_openai import ChatOpenAI
+from openai import OpenAI
+
+from CompletionCache import CompletionCache, completion_cache
+from Tracing import tracer
+
+default_base_url = os.getenv("LLM_BASE_URL", "https://api.chatanywhere.tech/v1")
+# LLM后端：openai 直接请求接口；record 请求接口并把结果录制到 LLM_RECORD_DIR；replay 只从录制目录回放，不访问网络
+default_backend = os.getenv("LLM_BACKEND", "openai")
+default_record_dir = os.getenv("LLM_RECORD_DIR", ".llm_cache/recordings")
+
+
+class RateLimiter:
+    """线程安全的限速器，保证相邻两次请求的间隔不小于1/rate秒，rate为空时不限速"""
+
+    def __init__(self, rate=None):
+        self.interval = 1.0 / rate if rate else 0.0
+        self.next_time = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            delay = self.next_time - now
+            self.next_time = max(now, self.next_time) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+class LLMMetrics:
+    """
+    按调用位置统计LLM请求的次数、缓存命中、失败次数、耗时与token用量
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sites = defaultdict(lambda: {
+            'calls': 0,
+            'cache_hits': 0,
+            'errors': 0,
+            'seconds': 0.0,
+            'max_seconds': 0.0,
+            'prompt_tokens': 0,
+            'completion_tokens': 0,
+        })
+
+    def record(self, site, seconds=0.0, prompt_tokens=0, completion_tokens=0, cache_hit=False, error=False):
+        with self.lock:
+            entry = self.sites[site]
+            entry['calls'] += 1
+            entry['cache_hits'] += int(cache_hit)
+            entry['errors'] += int(error)
+            entry['seconds'] += seconds
+            entry['max_seconds'] = max(entry['max_seconds'], seconds)
+            entry['prompt_tokens'] += prompt_tokens or 0
+            entry['completion_tokens'] += completion_tokens or 0
+
+    def summary(self):
+        """
+        :return: {调用位置: 统计}，avg_seconds 只按实际发出的请求计算
+        """
+        with self.lock:
+            result = {}
+            for site, entry in self.sites.items():
+                requests_sent = entry['calls'] - entry['cache_hits']
+                result[site] = dict(entry, seconds=round(entry['seconds'], 3),
+                                    max_seconds=round(entry['max_seconds'], 3),
+                                    avg_seconds=round(entry['seconds'] / requests_sent, 3) if requests_sent else 0.0)
+            return result
+
+    def print_summary(self):
+        print("LLM调用统计:")
+        print("site\tcalls\tcache_hits\terrors\tavg_s\tmax_s\tprompt_tokens\tcompletion_tokens")
+        for site, entry in sorted(self.summary().items()):
+            print(f"{site}\t{entry['calls']}\t{entry['cache_hits']}\t{entry['errors']}\t{entry['avg_seconds']}\t"
+                  f"{entry['max_seconds']}\t{entry['prompt_tokens']}\t{entry['completion_tokens']}")
+
+
+class GatewayCallback(BaseCallbackHandler):
+    """
+    挂在ChatOpenAI上的回调：请求前占用并发名额并限速，结束后释放名额并记录耗时与token用量
+    """
+
+    def __init__(self, gateway, site):
+        self.gateway = gateway
+        self.site = site
+        self.started = {}
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self.acquire(run_id, sum(len(prompt.encode('utf-8')) for prompt in prompts))
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self.acquire(run_id, sum(len(str(message.content).encode('utf-8'))
+                                 for batch in messages for message in batch))
+
+    def acquire(self, run_id, prompt_bytes):
+        self.gateway.semaphore.acquire()
+        self.gateway.rate_limiter.wait()
+        span = tracer.start_span(self.site, kind='llm', prompt_bytes=prompt_bytes, cache_hit=False,
+                                 backend=self.gateway.backend.name)
+        self.started[run_id] = (time.perf_counter(), span)
+
+    def release(self, run_id, error=None, **attributes):
+        started = self.started.pop(run_id, None)
+        if started is None:
+            return None
+        self.gateway.semaphore.release()
+        start, span = started
+        tracer.end_span(span, 'error' if error is not None else 'ok', error, **attributes)
+        return time.perf_counter() - start
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        usage = (response.llm_output or {}).get('token_usage') or {}
+        prompt_tokens = usage.get('prompt_tokens', 0)
+        completion_tokens = usage.get('completion_tokens', 0)
+        # 流式调用（Agent默认）的用量在消息的usage_metadata中
+        if not usage:
+            for generations in response.generations:
+                for generation in generations:
+                    metadata = getattr(getattr(generation, 'message', None), 'usage_metadata', None) or {}
+                    prompt_tokens += metadata.get('input_tokens', 0)
+                    completion_tokens += metadata.get('output_tokens', 0)
+        seconds = self.release(run_id, prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+        if seconds is not None:
+            self.gateway.metrics.record(self.site, seconds, prompt_tokens, completion_tokens)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        seconds = self.release(run_id, error)
+        if seconds is not None:
+            self.gateway.metrics.record(self.site, seconds, error=True)
+
+
+class RecordingStore:
+    """
+    LLM调用录制文件的读写，每次调用保存为录制目录下以请求哈希命名的一个JSON文件
+    """
+
+    def __init__(self, directory=default_record_dir):
+        self.directory = directory
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def chat_messages(messages):
+        """
+        将LangChain消息转换为可序列化的形式，录制与回放使用同一种转换保证键一致
+        """
+        return [{"role": message.type, "content": message.content} for message in messages]
+
+    def path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def load(self, key):
+        try:
+            with open(self.path(key), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def save(self, key, record):
+        with self.lock:
+            os.makedirs(self.directory, exist_ok=True)
+            temp_path = self.path(key) + '.tmp'
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(record, f, ensure_ascii=False, indent=2)
+            os.replace(temp_path, self.path(key))
+
+
+class RecordCallback(BaseCallbackHandler):
+    """
+    record 后端挂在ChatOpenAI上的回调，把Agent的每次调用录制到磁盘
+    """
+
+    def __init__(self, store, model, temperature):
+        self.store = store
+        self.model = model
+        self.temperature = temperature
+        self.pending = {}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self.pending[run_id] = (self.store.chat_messages(messages[0]), time.perf_counter())
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        pending = self.pending.pop(run_id, None)
+        if pending is None:
+            return
+        messages, start = pending
+        generation = response.generations[0][0]
+        usage = getattr(getattr(generation, 'message', None), 'usage_metadata', None) or {}
+        key = CompletionCache.make_key(self.model, messages, self.temperature)
+        self.store.save(key, {
+            'kind': 'chat_model',
+            'model': self.model,
+            'temperature': self.temperature,
+            'messages': messages,
+            'content': generation.text,
+            'latency': round(time.perf_counter() - start, 3),
+            'prompt_tokens': usage.get('input_tokens', 0),
+            'completion_tokens': usage.get('output_tokens', 0),
+        })
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self.pending.pop(run_id, None)
+
+
+class ReplayMissError(KeyError):
+    """回放时找不到对应的录制结果"""
+
+
+class ReplayChatModel(BaseChatModel):
+    """
+    replay 后端供Agent使用的聊天模型，按消息内容从录制目录取回结果，可模拟接口延迟
+    """
+
+    store: RecordingStore
+    model_name: str
+    temperature: float = 0.2
+    backend: "ReplayBackend"
+
+    model_config = {"arbitrary_types_allowed": True}
+
+    @property
+    def _llm_type(self):
+        return "replay"
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        messages = self.store.chat_messages(messages)
+        key = CompletionCache.make_key(self.model_name, messages, self.temperature)
+        record = self.backend.lookup(key, self.model_name, messages)
+        usage = {
+            'input_tokens': record.get('prompt_tokens', 0),
+            'output_tokens': record.get('completion_tokens', 0),
+            'total_tokens': record.get('prompt_tokens', 0) + record.get('completion_tokens', 0),
+        }
+        message = AIMessage(content=record['content'], usage_metadata=usage)
+        return ChatResult(generations=[ChatGeneration(message=message)],
+                          llm_output={'token_usage': {'prompt_tokens': usage['input_tokens'],
+                                                      'completion_tokens': usage['output_tokens']}})
+
+
+class OpenAIBackend:
+    """
+    直接请求OpenAI兼容接口的后端
+    """
+    name = 'openai'
+    # 该后端的结果是否写入/读取补全缓存
+    use_cache = True
+
+    def __init__(self, gateway):
+        self.gateway = gateway
+
+    def complete(self, model, messages, temperature=None):
+        """
+        :return: (补全内容, prompt_tokens, completion_tokens)；接口返回为空时抛出ValueError
+        """
+        options = {} if temperature is None else {"temperature": temperature}
+        chat_response = self.gateway.client.chat.completions.create(model=model, messages=messages, **options)
+        # 确保响应和choices存在且非空
+        if not chat_response or not chat_response.choices:
+            raise ValueError("Received an empty response from the API.")
+        usage = getattr(chat_response, 'usage', None)
+        return (chat_response.choices[0].message.content, getattr(usage, 'prompt_tokens', 0),
+                getattr(usage, 'completion_tokens', 0))
+
+    def chat_model(self, model, temperature, max_tokens, callbacks):
+        gateway = self.gateway
+        return ChatOpenAI(
+            model=model,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            api_key=gateway.api_key,
+            base_url=gateway.base_url,
+            http_client=gateway.http_client,
+            timeout=gateway.http_client.timeout,
+            max_retries=gateway.max_retries,
+            stream_usage=True,
+            callbacks=callbacks,
+        )
+
+
+class RecordingBackend(OpenAIBackend):
+    """
+    请求真实接口，同时把每次调用的输入、输出、耗时与token用量录制到磁盘，供 replay 后端回放
+    """
+    name = 'record'
+    # 录制时不读补全缓存：已缓存的提示词也要真正请求一次，否则不会留下录制结果，回放时找不到
+    use_cache = False
+
+    def __init__(self, gateway, store):
+        super().__init__(gateway)
+        self.store = store
+
+    def complete(self, model, messages, temperature=None):
+        start = time.perf_counter()
+        content, prompt_tokens, completion_tokens = super().complete(model, messages, temperature)
+        self.store.save(CompletionCache.make_key(model, messages, temperature), {
+            'kind': 'completion',
+            'model': model,
+            'temperature': temperature,
+            'messages': messages,
+            'content': content,
+            'latency': round(time.perf_counter() - start, 3),
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': completion_tokens,
+        })
+        return content, prompt_tokens, completion_tokens
+
+    def chat_model(self, model, temperature, max_tokens, callbacks):
+        return super().chat_model(model, temperature, max_tokens,
+                                  callbacks + [RecordCallback(self.store, model, temperature)])
+
+
+class ReplayBackend:
+    """
+    只从录制目录回放结果的本地后端，不访问网络，用于离线、可重复地测量清洗、日志挑选与用例执行等非LLM环节
+    """
+    name = 'replay'
+    # 回放本身就是确定性的，不经过补全缓存，保证每次都计入模拟延迟
+    use_cache = False
+
+    def __init__(self, gateway, store, latency=None, fallback=None):
+        """
+        :param latency: 模拟的接口延迟：None 不等待，数字为固定秒数，"recorded" 使用录制时的实际耗时
+        :param fallback: 找不到录制结果时调用 fallback(model, messages) 生成内容，为空时抛出ReplayMissError
+        """
+        self.gateway = gateway
+        self.store = store
+        self.latency = latency
+        self.fallback = fallback
+        self.misses = 0
+
+    def lookup(self, key, model, messages):
+        record = self.store.load(key)
+        if record is None:
+            self.misses += 1
+            if self.fallback is None:
+                raise ReplayMissError(f"no recording for {model} request {key} in {self.store.directory}")
+            record = {'content': self.fallback(model, messages), 'latency': 0.0}
+        if self.latency == 'recorded':
+            time.sleep(record.get('latency', 0.0))
+        elif self.latency:
+            time.sleep(float(self.latency))
+        return record
+
+    def complete(self, model, messages, temperature=None):
+        record = self.lookup(CompletionCache.make_key(model, messages, temperature), model, messages)
+        return record['content'], record.get('prompt_tokens', 0), record.get('completion_tokens', 0)
+
+    def chat_model(self, model, temperature, max_tokens, callbacks):
+        return ReplayChatModel(store=self.store, model_name=model, temperature=temperature, backend=self,
+                               callbacks=callbacks)
+
+
+ReplayChatModel.model_rebuild()
+
+
+class LLMGateway:
+    """
+    所有LLM调用的统一出口
+    共享一个带连接池和长连接的HTTP客户端，统一超时、重试、并发上限与限速，并按调用位置记录指标；
+    OpenAI客户端与各处Agent使用的ChatOpenAI都基于同一个连接池。
+    实际发送请求的后端可替换为录制（record）或本地回放（replay）
+    """
+
+    def __init__(self, api_key=None, base_url=default_base_url, timeout=None, connect_timeout=None,
+                 max_retries=None, max_concurrency=None, max_connections=None, rate=None, cache=completion_cache,
+                 backend=None):
+        """
+        未传入的参数依次读取环境变量 LLM_TIMEOUT、LLM_CONNECT_TIMEOUT、LLM_MAX_RETRIES、
+        LLM_MAX_CONCURRENCY、LLM_MAX_CONNECTIONS、LLM_BACKEND
+        :param timeout: 单次请求的读写超时（秒）
+        :param max_retries: 连接错误、429和5xx的自动重试次数
+        :param max_concurrency: 同时进行的LLM请求数上限
+        :param max_connections: 连接池大小
+        :param rate: 每秒最多发起的请求数，为空时不限速
+        :param backend: openai/record/replay
+        """
+        self.api_key = api_key or os.getenv("OPENAI_API_KEY")
+        self.base_url = base_url
+        self.timeout = timeout or float(os.getenv("LLM_TIMEOUT", "120"))
+        self.connect_timeout = connect_timeout or float(os.getenv("LLM_CONNECT_TIMEOUT", "10"))
+        self.max_retries = max_retries if max_retries is not None else int(os.getenv("LLM_MAX_RETRIES", "2"))
+        max_concurrency = max_concurrency or int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+        max_connections = max_connections or int(os.getenv("LLM_MAX_CONNECTIONS", "20"))
+        self.semaphore = threading.BoundedSemaphore(max_concurrency)
+        self.rate_limiter = RateLimiter(rate)
+        self.cache = cache
+        self.metrics = LLMMetrics()
+        self.http_client = httpx.Client(
+            timeout=httpx.Timeout(self.timeout, connect=self.connect_timeout),
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections,
+                                keepalive_expiry=60),
+        )
+        self.openai_client = None
+        self.client_lock = threading.Lock()
+        self.set_backend(backend or default_backend)
+
+    @property
+    def client(self):
+        """
+        首次使用时才创建OpenAI客户端，replay 后端不需要API key
+        """
+        with self.client_lock:
+            if self.openai_client is None:
+                self.openai_client = OpenAI(api_key=self.api_key, base_url=self.base_url,
+                                            http_client=self.http_client, timeout=self.http_client.timeout,
+                                            max_retries=self.max_retries)
+            return self.openai_client
+
+    def set_rate(self, rate):
+        self.rate_limiter = RateLimiter(rate)
+
+    def set_backend(self, name, record_dir=None, latency=None, fallback=None):
+        """
+        切换后端，需在创建 chat_model 之前调用
+        :param name: openai/record/replay
+        :param record_dir: 录制目录，默认读取环境变量 LLM_RECORD_DIR
+        :param latency: replay 模拟的延迟，默认读取环境变量 LLM_REPLAY_LATENCY（秒数或 recorded）
+        :param fallback: replay 找不到录制结果时生成内容的函数
+        """
+        store = RecordingStore(record_dir or default_record_dir)
+        if name == 'openai':
+            self.backend = OpenAIBackend(self)
+        elif name == 'record':
+            self.backend = RecordingBackend(self, store)
+        elif name == 'replay':
+            latency = latency if latency is not None else os.getenv("LLM_REPLAY_LATENCY") or None
+            self.backend = ReplayBackend(self, store, latency, fallback)
+        else:
+            raise ValueError(f"unknown LLM backend: {name}")
+        return self.backend
+
+    def complete(self, messages, model, temperature=None, site="chat"):
+        """
+        带缓存的chat.completions调用，命中缓存时不发起网络请求
+        :param site: 调用位置名称，用于分类统计
+        :return: 补全内容；接口返回为空时抛出ValueError
+        """
+        backend = self.backend
+        prompt_bytes = sum(len(str(message['content']).encode('utf-8')) for message in messages)
+        with tracer.span(site, kind='llm', model=model, prompt_bytes=prompt_bytes, backend=backend.name) as span:
+            key = self.cache.make_key(model, messages, temperature)
+            if backend.use_cache:
+                content = self.cache.get(key)
+                if content is not None:
+                    self.metrics.record(site, cache_hit=True)
+                    span['attributes']['cache_hit'] = True
+                    return content
+
+            with self.semaphore:
+                self.rate_limiter.wait()
+                start = time.perf_counter()
+                try:
+                    content, prompt_tokens, completion_tokens = backend.complete(model, messages, temperature)
+                except Exception:
+                    self.metrics.record(site, time.perf_counter() - start, error=True)
+                    raise
+                seconds = time.perf_counter() - start
+
+            self.metrics.record(site, seconds, prompt_tokens, completion_tokens)
+            span['attributes'].update(cache_hit=False, prompt_tokens=prompt_tokens,
+                                      completion_tokens=completion_tokens)
+            if backend.use_cache:
+                self.cache.set(key, model, content)
+            return content
+
+    def invalidate(self, messages, model, temperature=None):
+        """
+        从补全缓存中删除该提示词的结果，调用方判定返回内容无效时使用，使重试时重新请求接口
+        """
+        self.cache.delete(self.cache.make_key(model, messages, temperature))
+
+    def chat_model(self, site, model="gpt-4o-2024-08-06", temperature=0.2, max_tokens=1000):
+        """
+        创建供Agent使用的聊天模型，openai/record 后端为共享连接池的ChatOpenAI，replay 后端为本地回放模型
+        :param site: 调用位置名称，如 "agent"、"QTALLMFixer"
+        """
+        return self.backend.chat_model(model, temperature, max_tokens, [GatewayCallback(self, site)])
+
+
+llm_gateway = LLMGateway()
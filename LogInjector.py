@@ -0,0 +1,144 @@
+import argparse
+import ast
+import os
+
+# 日志插入方式：ast 为本地确定性插入（默认），llm 为原先由LLM改写整份代码的方式
+log_injection_mode = os.getenv("LOG_INJECTION_MODE", "ast")
+log_body_chars = int(os.getenv("LOG_BODY_CHARS", "1000"))
+
+http_methods = {'get', 'post', 'put', 'patch', 'delete', 'head', 'options', 'request'}
+
+
+def dotted_name(node):
+    """
+    :return: requests.post -> 'requests.post'，无法还原为点分名称时返回None
+    """
+    parts = []
+    while isinstance(node, ast.Attribute):
+        parts.append(node.attr)
+        node = node.value
+    if not isinstance(node, ast.Name):
+        return None
+    parts.append(node.id)
+    return '.'.join(reversed(parts))
+
+
+def is_request_call(node):
+    """
+    判断是否为接口调用：requests.<method>(...) 或 <...session>.<method>(...)
+    """
+    if not isinstance(node, ast.Call):
+        return False
+    name = dotted_name(node.func)
+    if name is None or '.' not in name:
+        return False
+    receiver, method = name.rsplit('.', 1)
+    if method not in http_methods:
+        return False
+    return receiver == 'requests' or receiver.lower().endswith('session')
+
+
+def is_log_of(node, variable):
+    """
+    判断节点是否为打印该响应的 self.log_info(...) 调用
+    """
+    if not (isinstance(node, ast.Call) and dotted_name(node.func) == 'self.log_info'):
+        return False
+    return any(isinstance(child, ast.Name) and child.id == variable for child in ast.walk(node))
+
+
+def already_logged(statements, index, variable):
+    """
+    判断赋值语句之后、该变量被重新赋值之前，同一代码块中是否已有打印该响应的日志，
+    如 response.raise_for_status() 之后才打印的情况，用于保证重复执行时不会重复插入
+    """
+    for statement in statements[index + 1:]:
+        if any(is_log_of(node, variable) for node in ast.walk(statement)):
+            return True
+        if any(isinstance(node, ast.Name) and node.id == variable and isinstance(node.ctx, ast.Store)
+               for node in ast.walk(statement)):
+            return False
+    return False
+
+
+def find_insertions(tree):
+    """
+    找出 TestCase 方法中所有接口调用的响应赋值语句
+    :return: [(赋值语句, 响应变量名)]
+    """
+    insertions = []
+    for cls in ast.walk(tree):
+        if not isinstance(cls, ast.ClassDef):
+            continue
+        for method in cls.body:
+            if not isinstance(method, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                continue
+            if not method.args.args or method.args.args[0].arg != 'self':
+                continue
+            for node in ast.walk(method):
+                for field in ('body', 'orelse', 'finalbody'):
+                    statements = getattr(node, field, None)
+                    if not isinstance(statements, list):
+                        continue
+                    for index, statement in enumerate(statements):
+                        if not (isinstance(statement, ast.Assign) and len(statement.targets) == 1
+                                and isinstance(statement.targets[0], ast.Name)
+                                and is_request_call(statement.value)):
+                            continue
+                        variable = statement.targets[0].id
+                        previous = statements[index - 1] if index > 0 else None
+                        following = statements[index + 1] if index + 1 < len(statements) else None
+                        # 与其他语句写在同一行（如 r = requests.get(u); x = 1）时无法按行插入，跳过
+                        if ((previous is not None and previous.end_lineno == statement.lineno)
+                                or (following is not None and following.lineno == statement.end_lineno)):
+                            continue
+                        if already_logged(statements, index, variable):
+                            continue
+                        insertions.append((statement, variable))
+    return insertions
+
+
+def inject_log_statements(source, body_chars=None):
+    """
+    在每个接口调用的响应赋值语句之后插入 self.log_info(f"Response Body: {response.text[:1000]}")，
+    按行插入，保留原有的注释和格式
+    :return: (插入日志后的源码, 插入的语句数)
+    :raises SyntaxError: 源码无法解析
+    """
+    body_chars = body_chars or log_body_chars
+    tree = ast.parse(source)
+    lines = source.splitlines(keepends=True)
+    inserted = 0
+    for statement, variable in sorted(find_insertions(tree), key=lambda item: -item[0].end_lineno):
+        first_line = lines[statement.lineno - 1]
+        indent = first_line[:len(first_line) - len(first_line.lstrip())]
+        # 与其他语句写在同一行（如 if ...: response = ...）时无法按行插入，跳过
+        if len(indent) != statement.col_offset:
+            continue
+        newline = '\n' if not lines[statement.end_lineno - 1].endswith('\n') else ''
+        log_line = f'{indent}self.log_info(f"Response Body: {{{variable}.text[:{body_chars}]}}")\n'
+        lines.insert(statement.end_lineno, newline + log_line)
+        inserted += 1
+    return ''.join(lines), inserted
+
+
+def inject_log_statements_file(path, body_chars=None):
+    """
+    :return: 插入的语句数
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        source = f.read()
+    updated, inserted = inject_log_statements(source, body_chars)
+    if inserted:
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(updated)
+    return inserted
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="在QTA测试用例的接口调用之后插入返回体日志语句")
+    parser.add_argument('paths', nargs='+', help="QTA测试用例文件")
+    parser.add_argument('--body-chars', type=int, default=None, help="日志中返回体的最大长度，默认1000")
+    args = parser.parse_args()
+    for test_path in args.paths:
+        print(f"{test_path}: 插入{inject_log_statements_file(test_path, args.body_chars)}条日志语句")
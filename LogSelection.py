@@ -0,0 +1,253 @@
+import argparse
+import ast
+import heapq
+import json
+import os
+import random
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from TokenCounter import estimate_tokens
+
+excluded_columns = ['URL', 'Request', 'Response', 'Method']
+
+
+def normalize_field_values(values):
+    """
+    将依赖字段的值转换为可分组的形式
+    列表按 sort_and_select_logs 的方式拼接成字符串，字典等不可哈希的值使用repr
+    """
+    def normalize(value):
+        if isinstance(value, list):
+            return ', '.join(map(str, value)).strip('[]')
+        if isinstance(value, (dict, set)):
+            return repr(value)
+        return value
+    return values.map(normalize)
+
+
+def build_candidates(df, url_codes, log_bytes, target_mask):
+    """
+    按依赖字段的取值构建候选日志组
+    同一字段取值相同的日志视为一组存在参数流转的日志，组内每个URL只保留体积最小的一条
+    :return: [(覆盖URL的位集, 日志字节数, 日志行号列表)]，只保留跨越至少两个目标URL的组
+    """
+    candidates = []
+    positions = np.arange(len(df))
+    for column in [col for col in df.columns if col not in excluded_columns]:
+        frame = pd.DataFrame({
+            'value': normalize_field_values(df[column]).to_numpy(),
+            'url': url_codes,
+            'bytes': log_bytes,
+            'position': positions,
+        })
+        frame = frame[frame['value'].notna()]
+        if frame.empty:
+            continue
+        frame['value'] = pd.factorize(frame['value'])[0]
+        # 每个 (取值, URL) 只保留体积最小的日志
+        frame = frame.sort_values(['value', 'url', 'bytes', 'position'], kind='stable')
+        frame = frame.drop_duplicates(['value', 'url'])
+        for _, group in frame.groupby('value', sort=False):
+            if len(group) < 2:
+                continue
+            mask = 0
+            for url in group['url'].tolist():
+                mask |= 1 << url
+            mask &= target_mask
+            if mask.bit_count() < 2:
+                continue
+            candidates.append((mask, int(group['bytes'].sum()), group['position'].tolist()))
+    return candidates
+
+
+def lazy_greedy_cover(candidates, target_mask):
+    """
+    懒惰贪心求解加权集合覆盖：每次选取“新增覆盖URL数/日志字节数”最大的候选组
+    候选组的收益只会随已覆盖URL增加而减少，因此堆顶重新计算后仍不低于次优时即可直接选中
+    :return: 选中的候选组下标列表与已覆盖URL的位集
+    """
+    heap = [(-mask.bit_count() / max(size, 1), index) for index, (mask, size, _) in enumerate(candidates)]
+    heapq.heapify(heap)
+    covered = 0
+    selected = []
+    while heap and covered != target_mask:
+        _, index = heapq.heappop(heap)
+        mask, size, _ = candidates[index]
+        gain = (mask & ~covered).bit_count()
+        if gain == 0:
+            continue
+        score = -gain / max(size, 1)
+        if heap and score > heap[0][0]:
+            heapq.heappush(heap, (score, index))
+            continue
+        selected.append(index)
+        covered |= mask
+    return selected, covered
+
+
+def select_logs_by_coverage(df, api_des_path):
+    """
+    :param df: find_and_extract_fields 返回的 pandas DataFrame对象
+    :param api_des_path: 包含API描述的CSV文件的路径，这些描述中包括了需要覆盖的URL列表
+    :return: 一个被选中的日志条目列表，按原日志顺序排列；先用存在参数依赖的日志组覆盖尽可能多的URL，
+             剩余URL各补充一条体积最小的日志
+    """
+    api_URLs = set(pd.read_csv(api_des_path)['URL'].tolist())
+    df = df.reset_index(drop=True)
+    if df.empty:
+        return []
+    url_codes, url_uniques = pd.factorize(df['URL'])
+    log_bytes = (df['Request'].fillna('').astype(str).str.len()
+                 + df['Response'].fillna('').astype(str).str.len()).to_numpy()
+
+    target_mask = 0
+    for code, URL in enumerate(url_uniques):
+        if URL in api_URLs:
+            target_mask |= 1 << code
+
+    candidates = build_candidates(df, url_codes, log_bytes, target_mask)
+    selected, covered = lazy_greedy_cover(candidates, target_mask)
+    positions = {position for index in selected for position in candidates[index][2]}
+
+    # 未被依赖日志组覆盖的URL，各选一条体积最小的日志
+    remaining = target_mask & ~covered
+    if remaining:
+        smallest = pd.DataFrame({'url': url_codes, 'bytes': log_bytes}).sort_values(['bytes'], kind='stable')
+        smallest = smallest.drop_duplicates('url')
+        for url, position in zip(smallest['url'].tolist(), smallest.index.tolist()):
+            if remaining >> url & 1:
+                positions.add(position)
+
+    selected_logs = []
+    seen = set()
+    for row in df.loc[sorted(positions), ['URL', 'Request', 'Response']].itertuples(index=False):
+        log = dict(URL=row.URL, Request=row.Request, Response=row.Response)
+        key = tuple(log.items())
+        if key not in seen:
+            seen.add(key)
+            selected_logs.append(log)
+    return selected_logs
+
+
+def parse_log_value(value):
+    """
+    解析日志中的Request/Response，无法解析时原样返回字符串
+    """
+    if not isinstance(value, str):
+        return None
+    try:
+        return json.loads(value)
+    except json.JSONDecodeError:
+        pass
+    try:
+        return ast.literal_eval(value)
+    except (ValueError, SyntaxError, MemoryError, RecursionError):
+        return value
+
+
+def truncate_strings(data, max_chars):
+    """
+    递归截断过长的字符串值，截断处使用固定格式的标记，便于LLM识别
+    """
+    if isinstance(data, dict):
+        return {key: truncate_strings(value, max_chars) for key, value in data.items()}
+    if isinstance(data, (list, tuple)):
+        return [truncate_strings(item, max_chars) for item in data]
+    if isinstance(data, str) and max_chars and len(data) > max_chars:
+        return f"{data[:max_chars]}...<truncated {len(data) - max_chars} chars>"
+    return data
+
+
+def compact_selected_logs(selected_logs, max_per_url=2, max_chars=500):
+    """
+    将选中的日志按预算压缩为JSON Lines文本
+    :param selected_logs: select_logs_by_coverage 返回的日志列表
+    :param max_per_url: 每个URL最多保留的日志条数，0表示不限制
+    :param max_chars: 单个字符串值的最大长度，0表示不截断
+    :return: (JSON Lines文本, 压缩统计)
+    """
+    per_url = {}
+    lines = []
+    for log in selected_logs:
+        count = per_url.get(log['URL'], 0)
+        if max_per_url and count >= max_per_url:
+            continue
+        per_url[log['URL']] = count + 1
+        record = {
+            'URL': log['URL'],
+            'Request': truncate_strings(parse_log_value(log['Request']), max_chars),
+            'Response': truncate_strings(parse_log_value(log['Response']), max_chars),
+        }
+        lines.append(json.dumps(record, ensure_ascii=False, separators=(',', ':'), default=str))
+    text = '\n'.join(lines) + ('\n' if lines else '')
+
+    original = str(selected_logs)
+    stats = {
+        'logs': len(selected_logs),
+        'kept_logs': len(lines),
+        'original_bytes': len(original.encode('utf-8')),
+        'bytes': len(text.encode('utf-8')),
+        'original_tokens': estimate_tokens(original),
+        'tokens': estimate_tokens(text),
+    }
+    return text, stats
+
+
+def make_synthetic_logs(rows, urls, fields, seed=0):
+    """
+    生成带依赖字段的模拟日志，列结构与 find_and_extract_fields 的输出一致
+    """
+    rng = random.Random(seed)
+    url_list = [f"https://wechat.wecity.qq.com/trpcapi/Service{index}/call" for index in range(urls)]
+    data = {'URL': [], 'Request': [], 'Response': [], 'Method': []}
+    for field in fields:
+        data[field] = []
+    for _ in range(rows):
+        URL = rng.choice(url_list)
+        data['URL'].append(URL)
+        data['Request'].append(str({'request': {'id': rng.randint(0, 10 ** 6)}, 'pad': 'x' * rng.randint(10, 400)}))
+        data['Response'].append(str({'code': 0, 'msg': 'success', 'pad': 'y' * rng.randint(10, 2000)}))
+        data['Method'].append('POST')
+        for field in fields:
+            # 约一半日志带有依赖字段，取值空间较小以形成跨接口的分组
+            data[field].append(rng.randint(0, rows // 20 + 1) if rng.random() < 0.5 else None)
+    return pd.DataFrame(data), url_list
+
+
+def log_size(logs):
+    return sum(len(str(log['Request'])) + len(str(log['Response'])) for log in logs)
+
+
+def benchmark(rows_list=(1000, 5000, 20000), urls=60, fields=('userId', 'orderId', 'channel')):
+    """
+    对比 sort_and_select_logs 与 select_logs_by_coverage 的耗时和选出的日志规模
+    """
+    # 基准测试不访问网络：GenerateByreActQTA 导入时创建的模型使用本地回放后端，无需 OPENAI_API_KEY
+    os.environ.setdefault("LLM_BACKEND", "replay")
+    from GenerateByreActQTA import sort_and_select_logs
+
+    print("rows\tfunction\tseconds\tlogs\tbytes\turls")
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for rows in rows_list:
+            df, url_list = make_synthetic_logs(rows, urls, list(fields))
+            path = os.path.join(temp_dir, f"api_{rows}.csv")
+            pd.DataFrame({'URL': url_list}).to_csv(path, index=False)
+            for name, function in (('sort_and_select_logs', sort_and_select_logs),
+                                   ('select_logs_by_coverage', select_logs_by_coverage)):
+                start = time.perf_counter()
+                logs = function(df.copy(), path)
+                elapsed = time.perf_counter() - start
+                print(f"{rows}\t{name}\t{elapsed:.3f}\t{len(logs)}\t{log_size(logs)}\t"
+                      f"{len({log['URL'] for log in logs})}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="日志覆盖选择性能对比")
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000, 5000, 20000], help="模拟日志行数")
+    parser.add_argument('--urls', type=int, default=60, help="模拟接口数量")
+    args = parser.parse_args()
+    benchmark(args.rows, args.urls)
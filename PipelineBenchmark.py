@@ -0,0 +1,219 @@
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import random
+import resource
+import sys
+import time
+
+# 基准测试不访问网络：LLM请求全部由本地回放后端的桩函数应答
+os.environ.setdefault("LLM_BACKEND", "replay")
+os.environ.setdefault("LLM_RECORD_DIR", os.path.join(".bench", "recordings"))
+
+bench_root = ".bench"
+default_sizes = [10_000, 100_000, 1_000_000]
+stages = ['clean', 'describe', 'extract', 'sort_and_select_logs', 'select_logs_by_coverage']
+dependency_fields = ['userId', 'orderId', 'cardNo']
+api_domain_url = "https://wechat.wecity.qq.com/trpcapi"
+stub_description = "接口定义：基准测试接口\n请求参数：userId（用户ID）\n回包信息：code（返回码）"
+
+
+def synthetic_urls(count):
+    services = ['NewPersonalCenter', 'THCfgServer', 'DailyQA', 'WeRunIF', 'thuser_info', 'MedOrder', 'HealthCard']
+    return [f"{api_domain_url}/{services[index % len(services)]}/method{index}" for index in range(count)]
+
+
+def make_row(rng, urls, started):
+    """
+    生成一条与 datasets/1/output.csv 同构的HAR风格日志：Started Date,URL,Headers,Request,Response
+    约一成为静态资源或其他域名的请求，用于覆盖清洗阶段的过滤逻辑
+    """
+    roll = rng.random()
+    if roll < 0.05:
+        URL = f"https://res.wecity.qq.com/static/img{rng.randint(0, 999)}.png"
+    elif roll < 0.1:
+        URL = f"https://report.qq.com/log?id={rng.randint(0, 10 ** 6)}"
+    else:
+        URL = rng.choice(urls) + (f"?t={rng.randint(0, 10 ** 9)}" if rng.random() < 0.3 else "")
+    user_id = rng.randint(1, 2000)
+    order_id = rng.randint(1, 50_000)
+    headers = [{'name': 'Host', 'value': 'wechat.wecity.qq.com'},
+               {'name': 'content-type', 'value': 'application/json;charset=utf-8'},
+               {'name': 'Th-Trace-Id', 'value': f"{rng.getrandbits(64):016x}"}]
+    body = {'request': {'userId': user_id, 'orderId': order_id if rng.random() < 0.5 else None,
+                        'page': rng.randint(1, 20)},
+            'context': {'channel': 'wechat', 'traceId': f"{rng.getrandbits(48):012x}"}}
+    request = {'method': 'POST', 'url': URL, 'httpVersion': 'HTTP/1.1', 'cookies': [], 'headers': headers,
+               'postData': {'mimeType': 'application/json', 'text': json.dumps(body)}}
+    data = {'userId': user_id, 'orderId': order_id, 'cardNo': f"C{rng.randint(1, 5000)}",
+            'items': [{'id': rng.randint(1, 10 ** 6), 'name': 'x' * rng.randint(5, 60)} for _ in range(rng.randint(0, 4))]}
+    response = {'status': 200, 'statusText': 'OK', 'httpVersion': 'HTTP/1.1', 'headers': [],
+                'content': {'size': 0, 'mimeType': 'application/json',
+                            'text': json.dumps({'code': 0, 'msg': 'success', 'data': data})}}
+    return [started, URL, str(headers), str(request), str(response)]
+
+
+def generate_dataset(rows, url_count=200, seed=0, root=bench_root):
+    """
+    生成（或复用已生成的）指定行数的 output.csv，以及接口集 merged.csv 与测试用例文本
+    :return: 数据集目录
+    """
+    data_URL = os.path.join(root, f"rows_{rows}_urls_{url_count}_seed_{seed}")
+    output_file = os.path.join(data_URL, 'output.csv')
+    urls = synthetic_urls(url_count)
+    if not os.path.exists(output_file):
+        os.makedirs(data_URL, exist_ok=True)
+        rng = random.Random(seed)
+        temp_file = output_file + '.tmp'
+        with open(temp_file, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(['Started Date', 'URL', 'Headers', 'Request', 'Response'])
+            for index in range(rows):
+                started = f"2024-07-10T13:{index // 60000 % 60:02d}:{index // 1000 % 60:02d}.{index % 1000:03d}Z"
+                writer.writerow(make_row(rng, urls, started))
+        os.replace(temp_file, output_file)
+        # 接口集：取前10个接口，供字段提取和日志挑选阶段使用
+        with open(os.path.join(data_URL, 'merged.csv'), 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(['用例步骤', 'URL', '接口定义'])
+            for index, URL in enumerate(urls[:10]):
+                writer.writerow([f"{index + 1}.基准测试步骤", URL, '基准测试接口'])
+        with open(os.path.join(data_URL, 'testcase.txt'), 'w', encoding='utf-8') as f:
+            f.write("1.基准测试步骤\n")
+    return data_URL
+
+
+def count_rows(path):
+    import pandas as pd
+    return sum(len(chunk) for chunk in pd.read_csv(path, usecols=[0], chunksize=200_000))
+
+
+def run_stage(stage, data_URL, chunksize=None, llm_latency=None):
+    """
+    在当前进程中执行一个阶段，只统计该阶段本身的耗时
+    :return: (处理的行数, 耗时秒数)
+    """
+    import pandas as pd
+    from LLMGateway import llm_gateway
+
+    output_file = os.path.join(data_URL, 'output.csv')
+    cleaned_file = os.path.join(data_URL, 'cleaned.csv')
+    merged_file = os.path.join(data_URL, 'merged.csv')
+
+    if stage == 'clean':
+        from ProcessDataGenerateMerge import Cleaner
+        rows = count_rows(output_file)
+        cleaner = Cleaner(output_file, os.path.join(data_URL, 'origin.csv'), cleaned_file, arg="URL_and_R",
+                          chunksize=chunksize)
+        start = time.perf_counter()
+        cleaner.process_csv()
+        return rows, time.perf_counter() - start
+
+    if not os.path.exists(cleaned_file):
+        raise FileNotFoundError(f"{cleaned_file} 不存在，请先执行 clean 阶段")
+
+    if stage == 'describe':
+        from ProcessDataGenerateMerge import build_processor
+        llm_gateway.set_backend('replay', latency=llm_latency, fallback=lambda model, messages: stub_description)
+        processor = build_processor(data_URL)
+        start = time.perf_counter()
+        df_cleaned = pd.read_csv(cleaned_file)
+        processor.step_1(df_cleaned.groupby('URL'), os.path.join(data_URL, 'describe.csv'))
+        return len(df_cleaned), time.perf_counter() - start
+
+    from GenerateByreActQTA import find_and_extract_fields, sort_and_select_logs
+    from LogSelection import select_logs_by_coverage
+    if stage == 'extract':
+        start = time.perf_counter()
+        df = find_and_extract_fields(merged_file, cleaned_file, dependency_fields)
+        return count_rows(cleaned_file), time.perf_counter() - start
+
+    df = find_and_extract_fields(merged_file, cleaned_file, dependency_fields)
+    select = sort_and_select_logs if stage == 'sort_and_select_logs' else select_logs_by_coverage
+    start = time.perf_counter()
+    select(df, merged_file)
+    return len(df), time.perf_counter() - start
+
+
+def stage_worker(conn, stage, data_URL, chunksize, llm_latency):
+    """
+    子进程入口：阶段的输出重定向到空设备，把行数、耗时和本进程的峰值RSS发回父进程
+    """
+    sys.stdout = open(os.devnull, 'w', encoding='utf-8')
+    try:
+        rows, seconds = run_stage(stage, data_URL, chunksize, llm_latency)
+        # Linux下ru_maxrss单位为KB
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        conn.send({'status': 'ok', 'rows': rows, 'seconds': seconds, 'peak_rss': peak_rss})
+    except Exception as e:
+        conn.send({'status': 'error', 'error': f"{type(e).__name__}: {e}"})
+    finally:
+        conn.close()
+
+
+def measure_stage(stage, data_URL, chunksize=None, llm_latency=None, timeout=600):
+    """
+    每个阶段在新的 spawn 子进程中执行，峰值RSS互不影响；超时的阶段被终止并标记为timeout
+    """
+    context = multiprocessing.get_context('spawn')
+    parent_conn, child_conn = context.Pipe(duplex=False)
+    process = context.Process(target=stage_worker, args=(child_conn, stage, data_URL, chunksize, llm_latency))
+    process.start()
+    child_conn.close()
+    result = {'status': 'timeout'}
+    if parent_conn.poll(timeout):
+        try:
+            result = parent_conn.recv()
+        except EOFError:
+            result = {'status': 'error', 'error': f"exit code {process.exitcode}"}
+    if process.is_alive():
+        process.kill()
+    process.join()
+    if result['status'] == 'ok':
+        result['rows_per_sec'] = round(result['rows'] / result['seconds'], 1) if result['seconds'] else None
+        result['seconds'] = round(result['seconds'], 3)
+    return dict(result, stage=stage)
+
+
+def run_benchmark(sizes=default_sizes, selected_stages=stages, url_count=200, chunksize=None, llm_latency=None,
+                  timeout=600, root=bench_root):
+    """
+    :return: 每个数据规模、每个阶段的测量结果列表
+    """
+    results = []
+    print("rows\tstage\tstatus\tseconds\trows/sec\tpeak_rss_mb")
+    for rows in sizes:
+        start = time.perf_counter()
+        data_URL = generate_dataset(rows, url_count, root=root)
+        print(f"# {rows}行数据集 {data_URL} 就绪，用时{time.perf_counter() - start:.1f}s")
+        for stage in selected_stages:
+            result = measure_stage(stage, data_URL, chunksize, llm_latency, timeout)
+            result['size'] = rows
+            results.append(result)
+            if result['status'] == 'ok':
+                print(f"{rows}\t{stage}\tok\t{result['seconds']}\t{result['rows_per_sec']}\t"
+                      f"{result['peak_rss'] / 1024 / 1024:.1f}")
+            else:
+                print(f"{rows}\t{stage}\t{result['status']}\t{result.get('error', '')}")
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="数据准备流水线的端到端基准测试（LLM由本地桩函数应答）")
+    parser.add_argument('--sizes', type=int, nargs='+', default=default_sizes, help="合成 output.csv 的行数")
+    parser.add_argument('--stages', nargs='+', choices=stages, default=stages, help="要测量的阶段")
+    parser.add_argument('--urls', type=int, default=200, help="合成日志中的接口数量")
+    parser.add_argument('--chunksize', type=int, default=None, help="清洗阶段的分块行数，默认整表清洗")
+    parser.add_argument('--llm-latency', type=float, default=None, help="describe阶段每次LLM调用模拟的延迟（秒）")
+    parser.add_argument('--timeout', type=float, default=600, help="单个阶段的超时时间（秒）")
+    parser.add_argument('--root', default=bench_root, help="合成数据集的存放目录")
+    parser.add_argument('--output', default=None, help="把结果写入JSON文件")
+    args = parser.parse_args()
+
+    benchmark_results = run_benchmark(args.sizes, args.stages, args.urls, args.chunksize, args.llm_latency,
+                                      args.timeout, args.root)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(benchmark_results, f, ensure_ascii=False, indent=2)
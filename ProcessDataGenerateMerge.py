@@ -1,30 +1,115 @@
+import argparse
 import ast
+import contextvars
 import os
 import re
 import csv
+import hashlib
 import json
+import shutil
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from urllib.parse import urlparse, urlunparse
 
-import openai
 import pandas as pd
 import requests
-from openai import OpenAI
 from openai import BadRequestError
 
+from CompletionCache import completion_cache
+from LLMGateway import llm_gateway
+from TokenCounter import estimate_tokens
+from Tracing import tracer
+
+try:
+    import orjson  # 可选依赖，安装后用于加速JSON解析
+except ImportError:
+    orjson = None
+
 data_root = "datasets/"  # 数据集根目录
 prompt_root = "prompt/"  # 数据集根目录
-openai_api_key = os.getenv("OPENAI_API_KEY")
-openai_api_base = "https://api.chatanywhere.tech/v1"
-client = OpenAI(api_key=openai_api_key,base_url=openai_api_base)
 
 
 
+class LogCellParser:
+    """
+    Request/Response单元格解析器
+    每列只检测一次数据格式，之后每个单元格直接交给对应的解码器，
+    不再对Python repr格式的单元格先做两次必然失败的json解析
+    """
+    # 以单引号键开头的dict/list视为Python repr格式
+    repr_pattern = re.compile(r"\s*[\[{]\s*'")
+
+    def __init__(self):
+        self.backend = 'orjson' if orjson is not None else 'json'
+        self.formats = {}  # 列名 -> 'repr' / 'json'
+        self.stats = Counter()  # 各解析路径命中次数
+
+    def json_loads(self, s):
+        if orjson is not None:
+            return orjson.loads(s)
+        return json.loads(s)
+
+    def detect_format(self, values):
+        for value in values:
+            if isinstance(value, str) and value.strip():
+                return 'repr' if self.repr_pattern.match(value) else 'json'
+        return 'json'
+
+    def column_format(self, column, values):
+        # 同一文件的同名列只检测一次，分块清洗时沿用首块的检测结果
+        if column not in self.formats:
+            self.formats[column] = self.detect_format(values)
+        return self.formats[column]
+
+    def loads(self, s, fmt='json'):
+        if fmt == 'repr':
+            try:
+                data = ast.literal_eval(s)
+                self.stats['literal_eval'] += 1
+                return data
+            except (ValueError, SyntaxError):
+                pass  # 个别单元格不是repr格式，退回原有解析链
+        try:
+            data = self.json_loads(s)
+            self.stats[self.backend] += 1
+            return data
+        except ValueError:
+            pass
+        try:
+            data = self.json_loads(s.replace("'", '"'))
+            self.stats[f'{self.backend}_replace'] += 1
+            return data
+        except ValueError:
+            pass
+        data = ast.literal_eval(s)
+        self.stats['literal_eval_fallback'] += 1
+        return data
+
+    def parse_column(self, column, values):
+        fmt = self.column_format(column, values)
+        return [self.loads(value, fmt) for value in values]
+
+
 class Cleaner:
-    def __init__(self, input_file, origin_file, cleaned_file, arg="URL_and_R"):
+    static_extensions = (
+        '.jpg', '.jpeg', '.png', '.svg', '.gif', '.bmp', '.tiff', '.ico',
+        '.mp4', '.avi', '.mov', '.wmv',
+        '.mp3', '.wav', '.aac', '.ogg',
+        '.pdf', '.doc', '.docx', '.xls', '.xlsx', '.csv',
+        '.html', '.css', '.js',
+        '.zip', '.rar', '.tar', '.gz',
+        '.xml'
+    )
+    api_domain = "wechat.wecity.qq.com"
+
+    def __init__(self, input_file, origin_file, cleaned_file, arg="URL_and_R", chunksize=None):
         self.input_file = input_file
         self.origin_file = origin_file
         self.cleaned_file = cleaned_file
         self.arg = arg
+        # 大于0时启用流式分块清洗，每次读取chunksize行
+        self.chunksize = chunksize
+        self.cell_parser = LogCellParser()
         csv.field_size_limit(10 * 1024 * 1024)
 
     # 清理url中的查询值
@@ -33,28 +118,32 @@ class Cleaner:
         clean_url = urlunparse(parsed_url._replace(query=""))
         return clean_url
 
+    # 批量清理url中的查询值，相同url只解析一次
+    def clean_urls(self, urls):
+        unique_urls = urls.drop_duplicates()
+        url_map = dict(zip(unique_urls, map(self.clean_url, unique_urls)))
+        return urls.map(url_map)
+
     # 判断该该日志的url是否为API接口
     def is_api_url(self, url):
-        static_extensions = (
-            '.jpg', '.jpeg', '.png', '.svg', '.gif', '.bmp', '.tiff', '.ico',
-            '.mp4', '.avi', '.mov', '.wmv',
-            '.mp3', '.wav', '.aac', '.ogg',
-            '.pdf', '.doc', '.docx', '.xls', '.xlsx', '.csv',
-            '.html', '.css', '.js',
-            '.zip', '.rar', '.tar', '.gz',
-            '.xml'
-        )
-
         # 检查 URL 是否以其中任一静态资源扩展名结束
-        return not url.endswith(static_extensions)
+        return not url.endswith(self.static_extensions)
 
     # 逐条删除非API URL日志,只保留和业务相关的域名接口请求
     def check_and_filter(self, row):
         url = row['URL']
-        if not self.is_api_url(url) or "wechat.wecity.qq.com" not in url:
+        if not self.is_api_url(url) or self.api_domain not in url:
             return pd.Series([pd.NA] * len(row), index=row.index)  # 返回与行长度相同、全为NA的Series
         return row
 
+    # 向量化删除非API URL日志,与check_and_filter逐行过滤结果一致
+    def filter_api_logs(self, df):
+        urls = df['URL']
+        is_api = ~urls.str.endswith(self.static_extensions, na=False)
+        in_domain = urls.str.contains(self.api_domain, regex=False, na=False)
+        # check_and_filter之后的dropna同样会丢弃含空值的行，这里保持一致
+        return df[is_api & in_domain].dropna()
+
     # 清理大于7000的单条日志内容
     def process_column(self, column_data):
         if pd.isna(column_data):
@@ -70,13 +159,7 @@ class Cleaner:
 
     # 安全载入json
     def safe_json_loads(self, s):
-        try:
-            return json.loads(s)
-        except json.JSONDecodeError:
-            try:
-                return json.loads(s.replace("'", '"'))
-            except json.JSONDecodeError:
-                return ast.literal_eval(s)
+        return self.cell_parser.loads(s)
 
     def process_log(self, row):
         # 解析Request列中的JSON数据
@@ -98,23 +181,61 @@ class Cleaner:
         row['Response'] = response_data.get('content', {}).get('text')
         return row
 
-    # 清洗过程
-    def process_csv(self):
-        df = pd.read_csv(self.input_file)
+    # 按列批量清理request以及response，结果与逐行process_log一致
+    def process_log_columns(self, df):
+        request_list = self.cell_parser.parse_column('Request', df['Request'].tolist())
+        response_list = self.cell_parser.parse_column('Response', df['Response'].tolist())
+        methods, requests_text, responses_text = [], [], []
+        for raw_request, request_data, raw_response, response_data in zip(
+                df['Request'], request_list, df['Response'], response_list):
+            if request_data is None:
+                print(f"Invalid JSON in Request: {raw_request}")
+                request_data = {}
+            methods.append(request_data.get('method'))
+            requests_text.append(request_data.get('postData', {}).get('text'))
+            if response_data is None:
+                print(f"Invalid JSON in Response: {raw_response}")
+                response_data = {}
+            responses_text.append(response_data.get('content', {}).get('text'))
+        df['Request'] = requests_text
+        df['Response'] = responses_text
+        df['Method'] = methods
+        return df
 
+    # 清理一批日志：去除无关日志并清理request以及response，整表和分块清洗共用
+    def clean_frame(self, df):
         # 去除Headers列
         if 'Headers' in df.columns:
             df = df.drop(columns=['Headers'])
 
         # 去除无关日志
-        df = df.apply(self.check_and_filter, axis=1).dropna()
-        df['URL'] = df['URL'].apply(self.clean_url)
+        df = self.filter_api_logs(df)
+        if df.empty:
+            return df
+        df['URL'] = self.clean_urls(df['URL'])
 
         # 清理request以及response
-        df = df.apply(self.process_log, axis=1)
+        df = self.process_log_columns(df)
         if self.arg in ["R", "URL_and_R"]:
             df['Request'] = df['Request'].apply(self.process_column)
             df['Response'] = df['Response'].apply(self.process_column)
+        return df
+
+    # 去除Number、Started Date列
+    def drop_origin_columns(self, df):
+        if 'Started Date' in df.columns:
+            df = df.drop(columns=['Started Date'])
+        if 'Number' in df.columns:
+            df = df.drop(columns=['Number'])
+        return df
+
+    # 清洗过程
+    def process_csv(self):
+        if self.chunksize:
+            return self.process_csv_chunked()
+
+        df = pd.read_csv(self.input_file)
+        df = self.clean_frame(df)
 
         # 添加行号列
         df.insert(0, 'Number', range(1, 1 + len(df)))
@@ -123,47 +244,152 @@ class Cleaner:
         df.to_csv(self.origin_file, index=False)
         print(f'处理完毕{self.origin_file}')
 
-        # 去除Number、Started Date列
-        if 'Started Date' in df.columns:
-            df = df.drop(columns=['Started Date'])
-        if 'Number' in df.columns:
-            df = df.drop(columns=['Number'])
+        df = self.drop_origin_columns(df)
         df.to_csv(self.cleaned_file, index=False)
         print(f'处理完毕{self.cleaned_file}')
+        print(f'解析统计{self.input_file}: {dict(self.cell_parser.stats)}')
+
+    # 流式清洗过程：按chunksize分块读取并逐块追加写入，内存占用与输入文件大小无关
+    def process_csv_chunked(self):
+        # usecols跳过Headers列，该列不会被解析进内存
+        reader = pd.read_csv(self.input_file, chunksize=self.chunksize,
+                             usecols=lambda column: column != 'Headers')
+        next_number = 1
+        empty_df = None
+        with open(self.origin_file, 'w', newline='', encoding='utf-8') as origin_csv, \
+                open(self.cleaned_file, 'w', newline='', encoding='utf-8') as cleaned_csv:
+            for chunk in reader:
+                df = self.clean_frame(chunk)
+                if df.empty:
+                    empty_df = df
+                    continue
+
+                # 行号跨块连续
+                write_header = next_number == 1
+                df.insert(0, 'Number', range(next_number, next_number + len(df)))
+                next_number += len(df)
+
+                df.to_csv(origin_csv, index=False, header=write_header)
+                self.drop_origin_columns(df).to_csv(cleaned_csv, index=False, header=write_header)
+
+            # 所有日志都被过滤时，与整表清洗一样只写入表头
+            if next_number == 1 and empty_df is not None:
+                empty_df.insert(0, 'Number', [])
+                empty_df.to_csv(origin_csv, index=False)
+                self.drop_origin_columns(empty_df).to_csv(cleaned_csv, index=False)
+        print(f'处理完毕{self.origin_file}')
+        print(f'处理完毕{self.cleaned_file}')
+        print(f'解析统计{self.input_file}: {dict(self.cell_parser.stats)}')
+
+
+class DescribeWriter:
+    """
+    describe.csv的批量写入器
+    整个step_1期间只打开一次文件，表头只写一次，数据行按批写入；
+    内容先写入临时文件，正常结束后再替换目标文件，中途出错不会留下写了一半的describe.csv；
+    与原先逐行追加一致，没有写入任何数据行且目标文件原本不存在时不创建文件
+    """
+
+    def __init__(self, file_path, fieldnames, append=True, batch_size=50):
+        """
+        :param file_path: 目标CSV文件路径
+        :param fieldnames: 表头
+        :param append: 为True时保留目标文件已有内容并在其后追加
+        :param batch_size: 缓冲多少行后写入一次
+        """
+        self.file_path = file_path
+        self.temp_path = f"{file_path}.tmp"
+        self.fieldnames = fieldnames
+        self.append = append
+        self.batch_size = batch_size
+        self.buffer = []
+        self.rows_written = 0
+        self.csvfile = None
+        self.writer = None
+
+    def __enter__(self):
+        self.target_existed = os.path.isfile(self.file_path)
+        has_rows = self.append and self.target_existed
+        if has_rows:
+            shutil.copyfile(self.file_path, self.temp_path)
+        self.csvfile = open(self.temp_path, 'a' if has_rows else 'w', newline='', encoding='utf-8-sig')
+        self.writer = csv.DictWriter(self.csvfile, fieldnames=self.fieldnames, extrasaction='ignore')
+        if not has_rows:
+            self.writer.writeheader()
+        return self
+
+    def write(self, row):
+        if row is None:
+            return
+        self.buffer.append(row)
+        self.rows_written += 1
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self.writer.writerows(self.buffer)
+            self.buffer = []
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.flush()
+        self.csvfile.close()
+        if exc_type is None and (self.rows_written or self.target_existed):
+            os.replace(self.temp_path, self.file_path)
+        else:
+            os.remove(self.temp_path)
+        return False
 
 
 class UserDataProcessor:
-    def __init__(self, data_URL, prompt_URL, data_path, txt_path, output_data=None, text_data=None):
+    describe_fieldnames = ['URL', '接口定义', '请求参数', '回包信息']
+    definition_pattern = re.compile(r'接口定义：(.*?)请求参数：', re.DOTALL)
+    request_pattern = re.compile(r'请求参数：(.*?)回包信息：', re.DOTALL)
+    response_pattern = re.compile(r'回包信息：(.*)', re.DOTALL)
+
+    def __init__(self, data_URL, prompt_URL, data_path, txt_path, output_data=None, text_data=None, chunksize=None,
+                 describe_workers=1, incremental=False, prompt_token_budget=None, describe_samples=5):
         self.data_URL = data_URL
         self.prompt_URL = prompt_URL
         self.data_path = data_path
         self.txt_path = txt_path
         self.output_data = output_data
         self.text_data = text_data
+        self.chunksize = chunksize
+        # step_1并发生成接口描述的线程数；限速与失败重试统一由LLM网关负责
+        self.describe_workers = describe_workers
+        # 增量模式下只重新描述新增或结构变化的URL
+        self.incremental = incremental
+        self.cell_parser = LogCellParser()
+        # 设置token预算后，step_1在发送前估算提示词长度并按需压缩，每个URL最多取describe_samples条样本
+        self.prompt_token_budget = prompt_token_budget
+        self.describe_samples = describe_samples
+        self.prompt_levels = {}  # URL -> 所选压缩级别
 
-    def chat(self, content=""):
+    def chat(self, content="", site="step_2"):
         """
         GPT接口
         :param content: 输入的问题内容，若为空则函数直接返回
+        :param site: 调用位置，用于分类统计LLM耗时与token用量
         :return: 以 JSON 格式返回服务器的响应
         """
         try:
-            chat_response = client.chat.completions.create(
-                model="gpt-4o-mini",  # 确保使用正确的模型
-                messages=[{"role": "system", "content": "You are an assistant."},
-                          {"role": "user", "content": content}]
-            )
-
-            # 确保响应和choices存在且非空
-            if chat_response and chat_response.choices:
-                return chat_response.choices[0].message.content
-            else:
-                raise ValueError("Received an empty response from the API.")
-
+            return self.request_chat(content, site)
         except Exception as e:
             print(f"Error during chat completion: {e}")
             return None
 
+    # 调用GPT接口，出错时直接抛出异常
+    def request_chat(self, content, site="step_2"):
+        # 经共享的LLM网关请求，相同提示词命中本地缓存时不再请求接口
+        return llm_gateway.complete(
+            model="gpt-4o-mini",  # 确保使用正确的模型
+            messages=[{"role": "system", "content": "You are an assistant."},
+                      {"role": "user", "content": content}],
+            site=site
+        )
+
     def extract_test_steps(self):
         """
         :param text_content: 
@@ -207,56 +433,54 @@ class UserDataProcessor:
         json_str = re.sub(r',\s*\}', r'}', json_str)
         return json_str
 
-    # 将从API接口获取的数据保存到CSV文件中
-    def save_to_csv(self, file_path, url, llm_response):
-        fieldnames = ['URL', '接口定义', '请求参数', '回包信息']
-
+    # 从LLM返回中提取接口定义、请求参数和回包信息，均为空时返回None
+    def parse_description(self, url, llm_response):
         if isinstance(llm_response, dict):
             llm_response = json.dumps(llm_response)
 
-        # 使用正则表达式提取接口定义、请求参数和回包信息
-        interface_definition = re.search(r'接口定义：(.*?)请求参数：', llm_response, re.DOTALL)
-        request_params = re.search(r'请求参数：(.*?)回包信息：', llm_response, re.DOTALL)
-        response_info = re.search(r'回包信息：(.*)', llm_response, re.DOTALL)
+        # 使用预编译的正则表达式提取接口定义、请求参数和回包信息
+        interface_definition = self.definition_pattern.search(llm_response)
+        request_params = self.request_pattern.search(llm_response)
+        response_info = self.response_pattern.search(llm_response)
 
         # 如果匹配到内容，则获取对应的组
         interface_definition = interface_definition.group(1).strip() if interface_definition else ''
         request_params = request_params.group(1).strip() if request_params else ''
         response_info = response_info.group(1).strip() if response_info else ''
 
+        # 确保字段不为空再写入
+        if not (interface_definition or request_params or response_info):
+            return None
+        return {
+            'URL': url,
+            '接口定义': interface_definition,
+            '请求参数': request_params,
+            '回包信息': response_info
+        }
+
+    # 将从API接口获取的数据保存到CSV文件中
+    def save_to_csv(self, file_path, url, llm_response):
+        row = self.parse_description(url, llm_response)
+
         # 检查文件是否存在
         file_exists = os.path.isfile(file_path)
 
         with open(file_path, 'a', newline='', encoding='utf-8-sig') as csvfile:
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
+            writer = csv.DictWriter(csvfile, fieldnames=self.describe_fieldnames)
 
             # 仅在文件不存在时写入表头
             if not file_exists:
                 writer.writeheader()
 
-            # 确保字段不为空再写入
-            if interface_definition or request_params or response_info:
-                writer.writerow({
-                    'URL': url,
-                    '接口定义': interface_definition,
-                    '请求参数': request_params,
-                    '回包信息': response_info
-                })
-
-    def step_1(self, grouped, API_file):
-        """
-        :param grouped: 一个包含URL和与之相关联的DataFrame group_df 的迭代器。
-        :param API_file: 用于保存CSV文件的路径
-        """
-        for URL, group_df in grouped:
-            request_data = group_df['Request'].tolist()
-            response_data = group_df['Response'].tolist()
+            if row is not None:
+                writer.writerow(row)
 
-            prompt = f"""
+    def build_describe_prompt(self, URL, request_info, response_info):
+        return f"""
             #接口信息#:```
             URL：{URL}
-            request：{self.traverse_json(request_data)}
-            response：{self.traverse_json(response_data)}
+            request：{request_info}
+            response：{response_info}
             ```
             #规则#：
             1.充分理解并分析'接口信息'中的内容；
@@ -277,84 +501,238 @@ class UserDataProcessor:
             请求参数：scene（场景标识），version（版本号），sub-businessid（子业务ID），channel（渠道标识），networkType（网络类型）
             回包信息：code（请求状态码），msg（状态信息），entryList（测评列表，包括测评按钮文本、花费、可用性、测评ID、完成状态、历史ID、图标链接、参与人数、跳转链接、测评题目数量、副标题、标题）       
             """
+
+    # 只保留日志的结构（去掉叶子值），用于上下文超长时压缩请求和响应
+    def compact_payloads(self, items):
+        compacted = []
+        for item in items:
+            # 使用修正函数处理原始JSON字符串
+            fixed_json_str = self.fix_json_string(item)
+            print(fixed_json_str)
+            # 尝试解析JSON字符串
             try:
-                llm_response = self.chat(prompt)
-                if llm_response is None:
-                    print(f"Error: No response received for URL: {URL}")
-                    continue
-                print(llm_response)
-                self.save_to_csv(API_file, URL, llm_response)
-            except BadRequestError as e:
-                if "context_length_exceeded" in str(e):
-                    print(f"Context length exceeded for URL: {URL}. Attempting to clean data and retry.")
-                    # 使用清理逻辑来处理请求和响应数据
-                    # 解析并清理
-                    request_list = []
-                    for item in request_data:
-                        # 使用修正函数处理原始JSON字符串
-                        fixed_json_str = self.fix_json_string(item)
-                        print(fixed_json_str)
-                        # 尝试解析JSON字符串
-                        try:
-                            data = json.loads(fixed_json_str)
-                            # print("JSON解析成功：", data)
-                            structured_data = self.strip_values(data)
-                            # 将结构化的JSON数据转换回字符串形式
-                            structured_json = json.dumps(structured_data, indent=2)
-                            request_list.append(structured_json)
-                        except json.JSONDecodeError as e:
-                            pass
-                    # print(f"request_list: {request_list}")
-                    response_list = []
-                    for item in response_data:
-                        # 使用修正函数处理原始JSON字符串
-                        fixed_json_str = self.fix_json_string(item)
-                        print(fixed_json_str)
-                        # 尝试解析JSON字符串
-                        try:
-                            data = json.loads(fixed_json_str)
-                            # print("JSON解析成功：", data)
-                            structured_data = self.strip_values(data)
-                            # 将结构化的JSON数据转换回字符串形式
-                            structured_json = json.dumps(structured_data, indent=2)
-                            response_list.append(structured_json)
-                        except json.JSONDecodeError as e:
-                            pass
-                    # 重新构建 prompt 并再次调用 self.chat
-                    prompt = f"""
-                    #接口信息#:```
-                    URL：{URL}
-                    request：{request_list}
-                    response：{response_list}
-                    ```
-                    #规则#：
-                    1.充分理解并分析'接口信息'中的内容；
-                    2.分析出接口的定义，使用简单的一句话进行概括描述；
-                    3.分析'request'中的内容，理解里面的请求体字段含义；
-                    4.分析'response'中的内容，理解里面响应体数据的字段含义；
-                    5.用简洁的语句返回；
-                    7.严格按照接口定义，请求参数,回包信息的顺序返回，格式内的请求参数，回包信息严格按照返回示例格式
-
-                    #返回内容#：
-                    严格按照以下格式返回：
-                    接口定义：用简洁的一句话描述接口的功能
-                    请求参数：理解请求体中的关键字段含义，用简洁的语句概括请求字段，返回格式为“字段名（字段含义）”，不返回字段值
-                    回包信息：忽略字段值，理解响应体中的关键字段含义，并用简洁的语句概括回包内容，返回格式为“字段名（字段含义）”
-
-                    #返回示例#
-                    接口定义：获取特定健康场景下的测评列表
-                    请求参数：scene（场景标识），version（版本号），sub-businessid（子业务ID），channel（渠道标识），networkType（网络类型）
-                    回包信息：code（请求状态码），msg（状态信息），entryList（测评列表，包括测评按钮文本、花费、可用性、测评ID、完成状态、历史ID、图标链接、参与人数、跳转链接、测评题目数量、副标题、标题）       
-                    """
-                    llm_response = self.chat(prompt)
-                    if llm_response is None:
-                        print(f"Error: No response received for URL: {URL}")
-                        continue
-                    print(llm_response)
-                    self.save_to_csv(API_file, URL, llm_response)
-            except Exception as e:
-                print(f"Error during processing URL {URL}: {str(e)}")
+                data = json.loads(fixed_json_str)
+                structured_data = self.strip_values(data)
+                # 将结构化的JSON数据转换回字符串形式
+                compacted.append(json.dumps(structured_data, indent=2))
+            except json.JSONDecodeError:
+                pass
+        return compacted
+
+    # 去除完全相同的样本，保持出现顺序
+    def dedupe_payloads(self, items):
+        unique = {}
+        for item in items:
+            unique.setdefault(item if isinstance(item, str) else repr(item), item)
+        return list(unique.values())
+
+    def sample_payloads(self, items):
+        """
+        挑选最多describe_samples条有代表性的样本：优先覆盖不同的结构，再按出现顺序补足
+        :param items: 去重后的样本
+        :return: 按原顺序排列的样本
+        """
+        if len(items) <= self.describe_samples:
+            return items
+        structures = set()
+        preferred, others = [], []
+        for index, item in enumerate(items):
+            structure = frozenset(self.schema_paths(self.parse_cell(item)))
+            if structure in structures:
+                others.append(index)
+            else:
+                structures.add(structure)
+                preferred.append(index)
+        chosen = (preferred + others)[:self.describe_samples]
+        return [items[index] for index in sorted(chosen)]
+
+    def compact_level(self, level, items, samples):
+        """
+        :param level: 压缩级别，full为完整样本，keys为每条样本的键路径，schema为全部样本键路径的并集
+        :param items: 去重后的全部样本
+        :param samples: 挑选出的代表性样本
+        """
+        if level == 'full':
+            return self.traverse_json(samples)
+        if level == 'keys':
+            return [sorted(self.schema_paths(self.parse_cell(item))) for item in samples]
+        paths = set()
+        for item in items:
+            paths.update(self.schema_paths(self.parse_cell(item)))
+        return sorted(paths)
+
+    def build_budgeted_prompt(self, URL, request_data, response_data):
+        """
+        在发送前本地估算token数，依次尝试 full -> keys -> schema 压缩级别，直到提示词不超过prompt_token_budget
+        :return: (压缩级别, 预估token数, 提示词)
+        """
+        requests_unique = self.dedupe_payloads(request_data)
+        responses_unique = self.dedupe_payloads(response_data)
+        request_samples = self.sample_payloads(requests_unique)
+        response_samples = self.sample_payloads(responses_unique)
+        for level in ('full', 'keys', 'schema'):
+            prompt = self.build_describe_prompt(URL,
+                                                self.compact_level(level, requests_unique, request_samples),
+                                                self.compact_level(level, responses_unique, response_samples))
+            tokens = estimate_tokens(prompt)
+            if tokens <= self.prompt_token_budget:
+                break
+        return level, tokens, prompt
+
+    def describe_url(self, URL, group_df, chat_fn=None):
+        """
+        生成单个接口的描述
+        :param URL: 接口URL
+        :param group_df: 该URL对应的日志
+        :param chat_fn: 调用LLM的函数，默认为self.chat
+        :return: LLM返回的接口描述，失败时返回None
+        """
+        chat_fn = chat_fn or (lambda content: self.chat(content, site="step_1"))
+        request_data = group_df['Request'].tolist()
+        response_data = group_df['Response'].tolist()
+        if self.prompt_token_budget:
+            level, tokens, prompt = self.build_budgeted_prompt(URL, request_data, response_data)
+            self.prompt_levels[URL] = level
+            print(f"URL: {URL} 使用压缩级别{level}，预估{tokens} tokens")
+        else:
+            prompt = self.build_describe_prompt(URL, self.traverse_json(request_data),
+                                                self.traverse_json(response_data))
+        try:
+            llm_response = chat_fn(prompt)
+        except BadRequestError as e:
+            if "context_length_exceeded" not in str(e):
+                raise
+            print(f"Context length exceeded for URL: {URL}. Attempting to clean data and retry.")
+            # 使用清理逻辑来处理请求和响应数据，重新构建 prompt 并再次调用
+            prompt = self.build_describe_prompt(URL, self.compact_payloads(request_data),
+                                                self.compact_payloads(response_data))
+            llm_response = chat_fn(prompt)
+        if llm_response is None:
+            print(f"Error: No response received for URL: {URL}")
+            return None
+        print(llm_response)
+        return llm_response
+
+    # describe_url的容错包装，单个URL出错不影响其它URL
+    def describe_url_safely(self, URL, group_df, chat_fn=None):
+        try:
+            return self.describe_url(URL, group_df, chat_fn)
+        except Exception as e:
+            print(f"Error during processing URL {URL}: {str(e)}")
+            return None
+
+    def iter_descriptions(self, grouped):
+        """
+        按URL顺序逐个生成接口描述
+        describe_workers大于1时，各URL的请求经有界线程池并发发出，限速和重试由 llm_gateway 统一处理，
+        结果仍按URL顺序返回，输出顺序与串行模式一致
+        :param grouped: 一个包含URL和与之相关联的DataFrame group_df 的迭代器。
+        :return: (URL, llm_response) 的迭代器，失败的URL对应None
+        """
+        if self.describe_workers <= 1:
+            for URL, group_df in grouped:
+                yield URL, self.describe_url_safely(URL, group_df)
+            return
+
+        def chat_fn(content):
+            # 出错时直接抛出：上下文超长交给describe_url压缩后重试，其他错误由describe_url_safely记为失败
+            return self.request_chat(content, site="step_1")
+
+        groups = list(grouped)
+        with ThreadPoolExecutor(max_workers=self.describe_workers) as pool:
+            # 复制当前上下文，线程中的LLM请求仍记录在所属数据集与step_1的span下
+            futures = [pool.submit(contextvars.copy_context().run, self.describe_url_safely, URL, group_df, chat_fn)
+                       for URL, group_df in groups]
+            for (URL, _), future in zip(groups, futures):
+                yield URL, future.result()
+
+    def step_1(self, grouped, API_file):
+        """
+        :param grouped: 一个包含URL和与之相关联的DataFrame group_df 的迭代器。
+        :param API_file: 用于保存CSV文件的路径
+        """
+        if self.incremental:
+            return self.step_1_incremental(grouped, API_file)
+        with DescribeWriter(API_file, self.describe_fieldnames) as writer:
+            for URL, llm_response in self.iter_descriptions(grouped):
+                if llm_response is not None:
+                    writer.write(self.parse_description(URL, llm_response))
+
+    # 解析单元格，无法解析的内容作为普通字符串处理
+    def parse_cell(self, cell):
+        if not isinstance(cell, str):
+            return None
+        try:
+            return self.cell_parser.loads(cell)
+        except (ValueError, SyntaxError, MemoryError, RecursionError):
+            return cell
+
+    # 只收集键路径，忽略字段值，列表下标统一记为[]
+    def schema_paths(self, data, prefix=''):
+        paths = set()
+        if isinstance(data, dict):
+            for key, value in data.items():
+                new_prefix = f"{prefix}.{key}" if prefix else str(key)
+                paths.add(new_prefix)
+                paths.update(self.schema_paths(value, new_prefix))
+        elif isinstance(data, list):
+            for value in data:
+                paths.update(self.schema_paths(value, f"{prefix}[]"))
+        return paths
 
+    def schema_fingerprint(self, group_df):
+        """
+        :param group_df: 同一URL下的全部日志
+        :return: 请求与响应结构（键路径，不含字段值）的哈希
+        """
+        paths = set()
+        for column in ('Request', 'Response'):
+            for cell in group_df[column]:
+                paths.update(f"{column}:{path}" for path in self.schema_paths(self.parse_cell(cell)))
+        return hashlib.sha256('\n'.join(sorted(paths)).encode('utf-8')).hexdigest()
+
+    def step_1_incremental(self, grouped, API_file):
+        """
+        增量生成接口描述：describe.csv旁维护一份结构指纹清单，
+        只对新增或请求/响应结构发生变化的URL调用LLM，其余URL沿用已有描述；
+        describe.csv整体重写，旧行被替换而非追加
+        :param grouped: 一个包含URL和与之相关联的DataFrame group_df 的迭代器。
+        :param API_file: 用于保存CSV文件的路径
+        """
+        manifest_path = os.path.splitext(API_file)[0] + '_manifest.json'
+        manifest = {}
+        if os.path.isfile(manifest_path):
+            with open(manifest_path, 'r', encoding='utf-8') as file:
+                manifest = json.load(file)
+        existing_rows = {}
+        if os.path.isfile(API_file):
+            with open(API_file, 'r', newline='', encoding='utf-8-sig') as csvfile:
+                existing_rows = {row['URL']: row for row in csv.DictReader(csvfile)}
+
+        groups = list(grouped)
+        fingerprints = {URL: self.schema_fingerprint(group_df) for URL, group_df in groups}
+        changed = [(URL, group_df) for URL, group_df in groups
+                   if URL not in existing_rows or manifest.get(URL) != fingerprints[URL]]
+        print(f"共{len(groups)}个接口，需重新描述{len(changed)}个")
+
+        new_rows = {}
+        for URL, llm_response in self.iter_descriptions(changed):
+            if llm_response is not None:
+                new_rows[URL] = self.parse_description(URL, llm_response)
+
+        new_manifest = {}
+        with DescribeWriter(API_file, self.describe_fieldnames, append=False) as writer:
+            for URL, _ in groups:
+                if URL in new_rows:
+                    row = new_rows[URL]
+                elif URL in existing_rows and manifest.get(URL) == fingerprints[URL]:
+                    row = existing_rows[URL]
+                else:
+                    continue  # 描述失败的接口不写入清单，下次运行会重试
+                new_manifest[URL] = fingerprints[URL]
+                writer.write(row)
+        with open(manifest_path, 'w', encoding='utf-8') as file:
+            json.dump(new_manifest, file, ensure_ascii=False, indent=2)
 
     def write_large_csv(self, file_path, data_list):
         """
@@ -406,24 +784,31 @@ class UserDataProcessor:
         print(new_dicts)
         return new_dicts
 
-    def to_find_line(self, read_path, new_dicts):
+    # 建立 URL -> describe.csv行号 的索引，同一URL可能对应多行
+    def build_url_index(self, describe_df):
+        url_index = defaultdict(list)
+        for position, URL in enumerate(describe_df['URL']):
+            url_index[URL].append(position)
+        return url_index
+
+    def to_find_line(self, read_path, new_dicts, describe_df=None):
         """
+        :param read_path: 接口描述文件路径，未传入describe_df时从该路径读取
         :param new_dicts: 列表嵌套字典
-        :return: 原本数据中找到的对应行
+        :param describe_df: 已读入的接口描述DataFrame
+        :return: 原本数据中找到的对应行，顺序与describe.csv中的行顺序一致
         """
+        if describe_df is None:
+            describe_df = pd.read_csv(read_path, encoding='utf-8', dtype=str)
+        # 与csv.reader读出的内容保持一致，空值为空字符串
+        rows = describe_df.fillna('').values.tolist()
+        url_index = self.build_url_index(describe_df)
+        positions = sorted({position for URL in {d['URL'] for d in new_dicts} for position in url_index.get(URL, [])})
         found_items = []
-        with open(read_path, mode='r', encoding='utf-8') as file:
-            csv_reader = csv.reader(file)
-            # line_number = 0  # 记录当前行号
-            for row in csv_reader:
-                # line_number += 1
-                # 检查当前行是否包含列表中字典的URL
-                for d in new_dicts:
-                    if d['URL'] in row:
-                        found_items.append(row)
-
-                        print("找到匹配项: {}".format(row))
-                        break
+        for position in positions:
+            row = rows[position]
+            found_items.append(row)
+            print("找到匹配项: {}".format(row))
         print(f"found_items:{found_items}")
         return found_items
 
@@ -433,25 +818,23 @@ class UserDataProcessor:
         :param new_dicts:列表嵌套字典
         :return: 数据存储用的字典
         """
+        # URL -> 用例步骤列表，保持new_dicts中的顺序
+        steps_by_url = defaultdict(list)
+        for d in new_dicts:
+            steps_by_url[d['URL']].append(d['用例步骤'])
+
         use_dicts = []
         for item in found_items:
-            # 假设每个item是一个列表，包含csv行数、URL、接口定义、请求参数和回包信息
+            # 假设每个item是一个列表，包含URL、接口定义、请求参数和回包信息
             URL = item[0]  # URL
-            definition = item[1]  # 接口定义
             request = item[2]  # 请求参数
             response = item[3]  # 回包信息
-            step_name = []
-            my_flag = 0
-            for d in new_dicts:
-                if d['URL'] == URL:
-                    my_flag = 1
-                    step_name.append(d['用例步骤'])
-            if my_flag:
+            if URL in steps_by_url:
                 entry = {
                     'URL': URL,
                     '请求参数': request,
                     '回包信息': response,
-                    '用例步骤': step_name
+                    '用例步骤': list(steps_by_url[URL])
                 }
                 use_dicts.append(entry)
         return use_dicts
@@ -462,7 +845,7 @@ class UserDataProcessor:
         :param txt_path: 用例步骤文本
         :param save_path: 存储的接口集文件
         """
-        my_data = pd.read_csv(read_path, encoding='utf-8')
+        my_data = pd.read_csv(read_path, encoding='utf-8', dtype=str)
         data_URL = my_data.loc[:, 'URL'].tolist()
         data_sub = my_data.loc[:, '接口定义'].tolist()
         my_text = self.text_data
@@ -498,7 +881,7 @@ class UserDataProcessor:
         response = self.chat(content=my_content)
         print(f"response: {response}")
         new_dicts = self.split_llm(response)
-        found_items = self.to_find_line(read_path, new_dicts)
+        found_items = self.to_find_line(read_path, new_dicts, my_data)
         use_dicts = self.save_csv(found_items, new_dicts)
         if use_dicts:
             self.write_large_csv(save_path, use_dicts)
@@ -511,32 +894,153 @@ class UserDataProcessor:
             return False
 
 
-    def main_workflow(self):
+    # 数据清洗阶段（CPU密集）
+    def clean_stage(self):
         input_file = f'{self.data_URL}/output.csv'
         origin_file = f'{self.data_URL}/origin.csv'
+        cleaned_file = f'{self.data_URL}/cleaned.csv'
+        cleaner = Cleaner(input_file, origin_file, cleaned_file, arg="URL_and_R", chunksize=self.chunksize)
+        with tracer.dataset(self.dataset_name), \
+                tracer.span('process_csv', input_bytes=os.path.getsize(input_file), chunksize=self.chunksize) as span:
+            cleaner.process_csv()
+            span['attributes']['parse_stats'] = dict(cleaner.cell_parser.stats)
+            span['attributes']['output_bytes'] = os.path.getsize(cleaned_file)
+        return cleaned_file
+
+    # 接口描述及接口集筛选阶段（等待LLM网络返回为主）
+    def llm_stage(self):
         cleaned_file = f'{self.data_URL}/cleaned.csv'
         API_file = f'{self.data_URL}/describe.csv'
-        cleaner = Cleaner(input_file, origin_file, cleaned_file, arg="URL_and_R")
-        cleaner.process_csv()
-        df_cleaned = pd.read_csv(cleaned_file)
-        grouped = df_cleaned.groupby('URL')
-        self.step_1(grouped, API_file)
-        # #step2
-        self.extract_test_steps()
-        read_path = f"{self.data_URL}/describe.csv"
-        save_path = f"{self.data_URL}/merged.csv"
-        no_api_path = f"{self.data_URL}/no_api_txt"
-        self.step_2(read_path, save_path, no_api_path)
-       
+        with tracer.dataset(self.dataset_name):
+            with tracer.span('step_1', describe_workers=self.describe_workers, incremental=self.incremental) as span:
+                df_cleaned = pd.read_csv(cleaned_file)
+                grouped = df_cleaned.groupby('URL')
+                span['attributes'].update(rows=len(df_cleaned), urls=grouped.ngroups)
+                self.step_1(grouped, API_file)
+            # #step2
+            self.extract_test_steps()
+            read_path = f"{self.data_URL}/describe.csv"
+            save_path = f"{self.data_URL}/merged.csv"
+            no_api_path = f"{self.data_URL}/no_api_txt"
+            with tracer.span('step_2') as span:
+                found_api = self.step_2(read_path, save_path, no_api_path)
+                span['attributes']['found_api'] = found_api
+            return found_api
+
+    # 追踪文件按数据集目录名区分，如 datasets/1 -> traces/1.jsonl
+    @property
+    def dataset_name(self):
+        return os.path.basename(os.path.normpath(self.data_URL))
+
+    def main_workflow(self):
+        self.clean_stage()
+        return self.llm_stage()
+
+
+def build_processor(data_URL, chunksize=None, **options):
+    dataset_name = os.path.basename(os.path.normpath(data_URL))
+    prompt_URL = os.path.join(prompt_root, dataset_name)
+    data_path = f'{data_URL}/output.csv'
+    txt_path = f"{data_URL}/testcase.txt"
+    return UserDataProcessor(data_URL, prompt_URL, data_path, txt_path, chunksize=chunksize, **options)
+
+
+# 进程池中执行的清洗任务，需为模块级函数以便序列化
+def clean_dataset(data_URL, chunksize=None):
+    return build_processor(data_URL, chunksize).clean_stage()
+
+
+class PipelineRunner:
+    """
+    并行数据集流水线
+    清洗阶段放入进程池，LLM阶段放入线程池；某个数据集清洗完成后立即进入LLM阶段，
+    单个数据集失败不影响其它数据集，结束时打印每个数据集的执行结果
+    """
+
+    def __init__(self, data_root=data_root, clean_workers=None, llm_workers=4, chunksize=None,
+                 describe_workers=1, describe_rate=None, incremental=False, prompt_token_budget=None):
+        self.data_root = data_root
+        self.clean_workers = clean_workers or os.cpu_count()
+        self.llm_workers = llm_workers
+        self.chunksize = chunksize
+        self.describe_workers = describe_workers
+        # 所有数据集共享同一个LLM网关，限速对整个流水线生效而不是每个数据集各自计算
+        self.describe_rate = describe_rate
+        self.incremental = incremental
+        self.prompt_token_budget = prompt_token_budget
+        self.results = {}
+
+    # 查找data_root下所有包含output.csv和testcase.txt的数据集目录
+    def discover_datasets(self):
+        datasets = []
+        for name in os.listdir(self.data_root):
+            data_URL = os.path.join(self.data_root, name)
+            if (os.path.isfile(os.path.join(data_URL, 'output.csv'))
+                    and os.path.isfile(os.path.join(data_URL, 'testcase.txt'))):
+                datasets.append(data_URL)
+        return sorted(datasets, key=self.dataset_sort_key)
+
+    # 数字目录按数值排序，其余目录排在之后按名称排序
+    @staticmethod
+    def dataset_sort_key(data_URL):
+        name = os.path.basename(data_URL)
+        return (0, int(name), '') if name.isdigit() else (1, 0, name)
+
+    def run_llm_stage(self, data_URL):
+        return build_processor(data_URL, self.chunksize, describe_workers=self.describe_workers,
+                               incremental=self.incremental,
+                               prompt_token_budget=self.prompt_token_budget).llm_stage()
+
+    def run(self):
+        if self.describe_rate:
+            llm_gateway.set_rate(self.describe_rate)
+        datasets = self.discover_datasets()
+        print(f"发现{len(datasets)}个数据集: {datasets}")
+        with ProcessPoolExecutor(max_workers=self.clean_workers) as clean_pool, \
+                ThreadPoolExecutor(max_workers=self.llm_workers) as llm_pool:
+            clean_futures = {clean_pool.submit(clean_dataset, data_URL, self.chunksize): data_URL
+                             for data_URL in datasets}
+            llm_futures = {}
+            for future in as_completed(clean_futures):
+                data_URL = clean_futures[future]
+                try:
+                    future.result()
+                except Exception as e:
+                    self.results[data_URL] = ('failed', 'clean', repr(e))
+                    continue
+                llm_futures[llm_pool.submit(self.run_llm_stage, data_URL)] = data_URL
+            for future in as_completed(llm_futures):
+                data_URL = llm_futures[future]
+                try:
+                    found_api = future.result()
+                except Exception as e:
+                    self.results[data_URL] = ('failed', 'llm', repr(e))
+                    continue
+                self.results[data_URL] = ('success', 'done', '' if found_api else 'no api use!')
+        self.print_summary(datasets)
+        return self.results
+
+    def print_summary(self, datasets):
+        success = sum(1 for status, _, _ in self.results.values() if status == 'success')
+        print(f"执行完毕: 成功{success}个, 失败{len(datasets) - success}个")
+        print(f"LLM缓存统计: {completion_cache.stats()}")
+        llm_gateway.metrics.print_summary()
+        for data_URL in datasets:
+            status, stage, message = self.results.get(data_URL, ('failed', 'unknown', ''))
+            print(f"{data_URL}\t{status}\t{stage}\t{message}")
 
 
 # 使用类
 if __name__ == '__main__':
-    for i in range(1,4):
-        data_URL = data_root + str(i)
-        prompt_URL = prompt_root + str(i)
-        data_path = f'{data_URL}/output.csv'
-        txt_path = f"{data_URL}/testcase.txt"
-        # user_data = "这里是用户数据"
-        processor = UserDataProcessor(data_URL, prompt_URL, data_path, txt_path)
-        processor.main_workflow()
+    parser = argparse.ArgumentParser(description="并行清洗数据并生成接口集")
+    parser.add_argument('--data-root', default=data_root, help="数据集根目录")
+    parser.add_argument('--clean-workers', type=int, default=None, help="清洗阶段进程数，默认CPU核数")
+    parser.add_argument('--llm-workers', type=int, default=4, help="LLM阶段线程数")
+    parser.add_argument('--chunksize', type=int, default=None, help="按块流式清洗时每块的行数")
+    parser.add_argument('--describe-workers', type=int, default=1, help="每个数据集step_1并发生成接口描述的线程数")
+    parser.add_argument('--describe-rate', type=float, default=None, help="整个流水线每秒最多发出的LLM请求数（所有数据集共享）")
+    parser.add_argument('--incremental', action='store_true', help="只重新描述新增或结构变化的接口")
+    parser.add_argument('--prompt-budget', type=int, default=None, help="step_1单个提示词的token预算，超出时先压缩再发送")
+    args = parser.parse_args()
+    PipelineRunner(args.data_root, args.clean_workers, args.llm_workers, args.chunksize,
+                   args.describe_workers, args.describe_rate, args.incremental, args.prompt_budget).run()
@@ -0,0 +1,174 @@
+import argparse
+import os
+import re
+import time
+
+from QTASuiteRunner import case_result_pattern
+
+# 摘要模式：QTA_OUTPUT_DIGEST=0 时 RunQTACode 恢复返回完整的 runtest 输出
+output_digest = os.getenv("QTA_OUTPUT_DIGEST", "1") not in ("", "0")
+default_log_dir = os.getenv("QTA_LOG_DIR", ".qta_logs")
+
+step_pattern = re.compile(r'^步骤(\d+): (.*)$')
+step_results_pattern = re.compile(r'^测试用例步骤结果:\s*(.*)$', re.M)
+# 加载失败的原因，如 "MedTesttest.test_1 (error: ModuleNotFoundError: No module named 'x')"
+load_error_pattern = re.compile(r'^load test failed: (.*)$', re.M)
+log_level_pattern = re.compile(r'^(DEBUG|INFO|WARNING|ERROR|CRITICAL|ASSERT):')
+separator_pattern = re.compile(r'^[-=]{5,}')
+assert_location_pattern = re.compile(r'File "([^"]+)", line (\d+)')
+assert_expression_pattern = re.compile(r'^\s*\[(.*?)\] assert\s+(.*)$')
+http_status_patterns = [
+    re.compile(r'\b([1-5]\d\d) (?:Client|Server) Error'),
+    re.compile(r'status[_ ]?code\W{1,3}([1-5]\d\d)\b', re.I),
+    re.compile(r'<Response \[([1-5]\d\d)\]>'),
+]
+
+
+def parse_step_results(output):
+    """
+    解析“测试用例步骤结果:  1:通过 2:失败”一行
+    :return: {步骤序号: 结果}
+    """
+    results = {}
+    for line in step_results_pattern.findall(output):
+        for item in line.split():
+            index, _, result = item.partition(':')
+            if index.isdigit():
+                results[int(index)] = result
+    return results
+
+
+def digest_test_output(output, excerpt_chars=200):
+    """
+    把 manage.py runtest 的输出解析为紧凑的结构
+    :param excerpt_chars: 每个步骤返回体摘录的最大长度
+    :return: {'passed', 'cases', 'load_errors', 'steps': [{index, name, result, http_status, response_excerpt,
+             failed_assertions, errors}]}
+    """
+    output = output or ''
+    cases = {name: passed == 'True' for name, passed in case_result_pattern.findall(output)}
+    steps = []
+    step = None
+    lines = output.splitlines()
+    position = 0
+    while position < len(lines):
+        line = lines[position]
+        match = step_pattern.match(line)
+        if match:
+            step = {'index': int(match.group(1)), 'name': match.group(2).strip(), 'result': None,
+                    'http_status': [], 'response_excerpt': None, 'failed_assertions': [], 'errors': []}
+            steps.append(step)
+        elif step is not None and line.startswith('='):
+            step = None
+        elif step is not None:
+            for pattern in http_status_patterns:
+                for status in pattern.findall(line):
+                    if int(status) not in step['http_status']:
+                        step['http_status'].append(int(status))
+            if line.startswith('INFO:') and 'Response Body' in line and step['response_excerpt'] is None:
+                body = line.split('Response Body', 1)[1].lstrip(':： ')
+                step['response_excerpt'] = body[:excerpt_chars] + ('...' if len(body) > excerpt_chars else '')
+            elif line.startswith('ASSERT:'):
+                # 断言失败块：调用位置、断言代码、[检查点名称] assert 表达式
+                assertion = {'location': None, 'check': None, 'expression': None}
+                position += 1
+                while position < len(lines) and lines[position].startswith(' '):
+                    block_line = lines[position]
+                    location = assert_location_pattern.search(block_line)
+                    expression = assert_expression_pattern.match(block_line)
+                    if location:
+                        assertion['location'] = f"{os.path.basename(location.group(1))}:{location.group(2)}"
+                    elif expression:
+                        assertion['check'] = expression.group(1)
+                        assertion['expression'] = expression.group(2).strip()
+                    position += 1
+                step['failed_assertions'].append(assertion)
+                continue
+            elif line.startswith(('CRITICAL:', 'ERROR:')):
+                # 带异常栈时最后一行是异常类型与信息；self.fail()、log_error 等没有异常栈，保留该行本身。
+                # 遇到空行、分隔线、下一条日志或下一个步骤即结束
+                position += 1
+                last = line
+                while (position < len(lines) and lines[position].strip()
+                       and not step_pattern.match(lines[position])
+                       and not log_level_pattern.match(lines[position])
+                       and not separator_pattern.match(lines[position])):
+                    last = lines[position]
+                    for pattern in http_status_patterns:
+                        for status in pattern.findall(last):
+                            if int(status) not in step['http_status']:
+                                step['http_status'].append(int(status))
+                    position += 1
+                step['errors'].append(last.strip()[:300])
+                continue
+        position += 1
+
+    for index, result in parse_step_results(output).items():
+        for item in steps:
+            if item['index'] == index:
+                item['result'] = result
+    return {
+        'passed': bool(cases) and all(cases.values()),
+        'cases': cases,
+        'load_errors': [error.strip() for error in load_error_pattern.findall(output)],
+        'steps': steps,
+    }
+
+
+def format_digest(digest, log_path=None):
+    """
+    把摘要格式化为供Agent阅读的短文本
+    """
+    if digest['load_errors']:
+        head = f"用例加载失败: {'; '.join(digest['load_errors'])}"
+    elif not digest['cases']:
+        head = "未执行任何用例（请检查文件内容与用例结构）"
+    else:
+        head = f"用例结果: {'通过' if digest['passed'] else '失败'} ({', '.join(digest['cases'])})"
+    lines = [head]
+    for step in digest['steps']:
+        parts = [f"步骤{step['index']} {step['name']}: {step['result'] or '未知'}"]
+        if step['http_status']:
+            parts.append("HTTP " + ','.join(map(str, step['http_status'])))
+        if step['response_excerpt']:
+            parts.append(f"返回: {step['response_excerpt']}")
+        for assertion in step['failed_assertions']:
+            parts.append(f"断言失败: [{assertion['check']}] {assertion['expression']} ({assertion['location']})")
+        for error in step['errors']:
+            parts.append(f"异常: {error}")
+        lines.append(' | '.join(parts))
+    if log_path:
+        lines.append(f"完整日志: {log_path}")
+    return '\n'.join(lines)
+
+
+def save_full_output(test_module, output, log_dir=default_log_dir):
+    """
+    完整输出保存到磁盘，摘要中只给出路径
+    :return: 日志文件路径
+    """
+    os.makedirs(log_dir, exist_ok=True)
+    log_path = os.path.join(log_dir, f"{test_module}_{time.strftime('%Y%m%d_%H%M%S')}_{time.time_ns() % 10 ** 6}.log")
+    with open(log_path, 'w', encoding='utf-8') as f:
+        f.write(output or '')
+    return log_path
+
+
+def digest_and_save(test_module, output, excerpt_chars=200, log_dir=default_log_dir):
+    """
+    :return: 摘要文本（含完整日志路径）
+    """
+    log_path = save_full_output(test_module, output, log_dir)
+    return format_digest(digest_test_output(output, excerpt_chars), log_path)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="把 manage.py runtest 的输出压缩为摘要")
+    parser.add_argument('log', help="runtest 输出文件")
+    parser.add_argument('--excerpt-chars', type=int, default=200, help="返回体摘录的最大长度")
+    args = parser.parse_args()
+    with open(args.log, 'r', encoding='utf-8') as log_file:
+        full_output = log_file.read()
+    text = format_digest(digest_test_output(full_output, args.excerpt_chars))
+    print(text)
+    print(f"# {len(full_output)} -> {len(text)} chars")
@@ -0,0 +1,324 @@
+import argparse
+import hashlib
+import importlib
+import multiprocessing
+import os
+import queue
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from CompletionCache import CompletionCache
+from Tracing import tracer
+
+qta_project_root = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'medtesttestproj')
+# 用例执行超时时返回的退出码，与 timeout 命令一致
+timeout_exit_code = 124
+
+
+def to_test_module(input_test_file):
+    """
+    将测试用例文件路径转换为QTA用例模块名
+    :param input_test_file: 如 "medtesttestproj/MedTesttest/test_1.py"
+    :return: 如 "MedTesttest.test_1"，无法识别时返回None
+    """
+    input_test_file = input_test_file.strip('"').strip("'").strip().replace('"', '').replace("'", '').replace("/", ".")
+    match = re.search(r'\.([^.]+)\.([^.]+)\.py$', input_test_file)
+    if match:
+        return f"{match.group(1)}.{match.group(2)}"
+    return None
+
+
+def run_with_subprocess(test_module, timeout=None):
+    """
+    通过 manage.py runtest 在新进程中执行测试用例，标准错误（如“load test failed”及其异常栈）合并到输出中
+    :param timeout: 超时时间（秒），超时后终止用例进程
+    :return: (输出, 退出码)
+    """
+    # 不经过shell，超时时终止的就是用例进程本身
+    command = [sys.executable, 'medtesttestproj/manage.py', 'runtest', test_module]
+    try:
+        # 通过 subprocess 运行命令并捕获输出，指定编码为 utf-8
+        result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, check=True,
+                                encoding='utf-8', errors='replace', timeout=timeout)
+        return result.stdout, 0
+    except subprocess.CalledProcessError as e:
+        # 如果命令失败，返回捕获到的输出
+        return e.stdout, e.returncode
+    except subprocess.TimeoutExpired as e:
+        output = e.stdout.decode('utf-8', errors='replace') if isinstance(e.stdout, bytes) else (e.stdout or '')
+        return output + f"\nQTA用例{test_module}执行超时（超过{timeout}秒），已终止\n", timeout_exit_code
+
+
+def lib_signature(project_root):
+    """
+    :return: MedTestlib 下各源码文件的修改时间，用于判断公共库是否需要重新加载
+    """
+    signature = []
+    for root, dirs, files in os.walk(os.path.join(project_root, 'MedTestlib')):
+        dirs[:] = sorted(name for name in dirs if name != '__pycache__')
+        for name in sorted(files):
+            if name.endswith('.py'):
+                path = os.path.join(root, name)
+                signature.append((path, os.stat(path).st_mtime_ns))
+    return tuple(signature)
+
+
+def worker_main(conn, project_root):
+    """
+    常驻测试进程：只在启动时完成一次 sys.path 配置和 testbase 导入，
+    之后循环接收用例模块名，重新加载发生变化的用例模块并执行，返回与 manage.py runtest 相同的标准输出
+    """
+    # 与 manage.py 相同的路径配置
+    if project_root not in sys.path:
+        sys.path.insert(0, project_root)
+    exlib_dir = os.path.join(project_root, 'exlib')
+    if os.path.isdir(exlib_dir):
+        for filename in os.listdir(exlib_dir):
+            if filename.endswith('.egg'):
+                lib_path = os.path.join(exlib_dir, filename)
+                if os.path.isfile(lib_path) and lib_path not in sys.path:
+                    sys.path.insert(0, lib_path)
+    sys.dont_write_bytecode = True
+    from testbase.management import ManagementTools
+
+    module_mtimes = {}
+    loaded_lib_signature = lib_signature(project_root)
+    while True:
+        try:
+            test_module = conn.recv()
+        except EOFError:
+            break
+        if test_module is None:
+            break
+
+        # MedTestlib 变化时卸载公共库及所有已加载的用例模块，用例会引用公共库中的旧类
+        signature = lib_signature(project_root)
+        if signature != loaded_lib_signature:
+            for name in list(sys.modules):
+                if name == 'MedTestlib' or name.startswith('MedTestlib.'):
+                    del sys.modules[name]
+            for name in module_mtimes:
+                sys.modules.pop(name, None)
+            module_mtimes.clear()
+            importlib.invalidate_caches()
+            loaded_lib_signature = signature
+
+        # 只重新加载源码发生变化的用例模块
+        module_file = os.path.join(project_root, *test_module.split('.')) + '.py'
+        mtime = os.stat(module_file).st_mtime_ns if os.path.isfile(module_file) else None
+        if module_mtimes.get(test_module) != mtime:
+            sys.modules.pop(test_module, None)
+            importlib.invalidate_caches()
+            module_mtimes[test_module] = mtime
+
+        # 在文件描述符层面捕获标准输出，QTA的报告对象在导入时就绑定了sys.stdout；
+        # 与子进程方式一样把标准错误合并到输出中，用例加载失败的原因写在标准错误里
+        with tempfile.TemporaryFile() as capture:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            saved_fd = os.dup(1)
+            saved_err_fd = os.dup(2)
+            os.dup2(capture.fileno(), 1)
+            os.dup2(capture.fileno(), 2)
+            try:
+                sys.argv = ['manage.py', 'runtest', test_module]
+                exit_code = ManagementTools().run()
+            except SystemExit as e:
+                exit_code = e.code if isinstance(e.code, int) else 1
+            except Exception as e:
+                print(f"{type(e).__name__}: {e}")
+                exit_code = 1
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os.dup2(saved_fd, 1)
+                os.dup2(saved_err_fd, 2)
+                os.close(saved_fd)
+                os.close(saved_err_fd)
+            capture.seek(0)
+            output = capture.read().decode('utf-8', errors='replace')
+        conn.send((output, exit_code))
+
+
+class QTATestWorker:
+    """
+    常驻QTA测试进程的客户端
+    省去每次执行用例时的解释器启动、exlib扫描和testbase导入；工作进程异常退出时退回 subprocess 方式执行，
+    执行超时时终止工作进程并返回超时结果，下次执行时重新启动。
+    工作进程以spawn方式启动，调用方（Agent会话线程、连接池）处于多线程状态时fork并不安全
+    """
+
+    def __init__(self, project_root=qta_project_root, timeout=600):
+        self.project_root = project_root
+        self.timeout = timeout
+        self.process = None
+        self.conn = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        context = multiprocessing.get_context('spawn')
+        parent_conn, child_conn = context.Pipe()
+        self.process = context.Process(target=worker_main, args=(child_conn, self.project_root), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.conn = parent_conn
+
+    def stop(self):
+        if self.process is not None and self.process.is_alive():
+            try:
+                self.conn.send(None)
+                self.process.join(5)
+            except (BrokenPipeError, OSError):
+                pass
+            if self.process.is_alive():
+                self.process.kill()
+        self.process = None
+        self.conn = None
+
+    def run(self, test_module):
+        """
+        :param test_module: 用例模块名，如 "MedTesttest.test_1"
+        :return: (标准输出, 退出码)
+        """
+        with self.lock:
+            try:
+                if self.process is None or not self.process.is_alive():
+                    self.start()
+                self.conn.send(test_module)
+                if self.conn.poll(self.timeout):
+                    return self.conn.recv()
+                # 超时的用例改用子进程重跑同样会超时，直接终止工作进程并返回超时结果
+                self.process.kill()
+                self.stop()
+                return f"QTA用例{test_module}执行超时（超过{self.timeout}秒），已终止\n", timeout_exit_code
+            except (EOFError, BrokenPipeError, OSError) as e:
+                print(f"QTA常驻进程异常({e})，改用子进程执行")
+            self.stop()
+        return run_with_subprocess(test_module, self.timeout)
+
+
+class QTAWorkerPool:
+    """
+    多个常驻QTA测试进程组成的池，多个Agent会话并发执行用例时互不阻塞
+    """
+
+    def __init__(self, size=1, project_root=qta_project_root, timeout=600):
+        self.project_root = project_root
+        self.timeout = timeout
+        self.size = 0
+        self.idle = queue.Queue()
+        self.lock = threading.Lock()
+        self.resize(size)
+
+    def resize(self, size):
+        """
+        只扩容不缩容，新增的工作进程在首次执行用例时才启动
+        """
+        with self.lock:
+            while self.size < size:
+                self.idle.put(QTATestWorker(self.project_root, self.timeout))
+                self.size += 1
+
+    def run(self, test_module):
+        worker = self.idle.get()
+        try:
+            return worker.run(test_module)
+        finally:
+            self.idle.put(worker)
+
+
+# 环境变量 QTA_PERSISTENT_RUNNER=0 时每次都通过子进程执行，QTA_RUNNER_WORKERS 为常驻进程数
+use_persistent_runner = os.getenv("QTA_PERSISTENT_RUNNER", "1") not in ("", "0")
+qta_worker_pool = QTAWorkerPool(int(os.getenv("QTA_RUNNER_WORKERS", "1")))
+
+# 执行结果缓存：用例源码与 MedTestlib 均未变化时，在有效期内直接返回上次的输出
+# QTA_RESULT_CACHE_TTL 为有效期（秒），设为0关闭缓存；QTA_RESULT_CACHE_BYPASS=1 时总是重新执行
+qta_result_cache_ttl = float(os.getenv("QTA_RESULT_CACHE_TTL", "3600"))
+qta_result_cache = CompletionCache(
+    path=os.getenv("QTA_RESULT_CACHE_PATH", ".llm_cache/qta_results.sqlite3"),
+    max_bytes=64 * 1024 * 1024,
+    max_age_days=qta_result_cache_ttl / (24 * 3600),
+    bypass=os.getenv("QTA_RESULT_CACHE_BYPASS", "") not in ("", "0"),
+)
+
+
+def hash_sources(test_module, project_root=qta_project_root):
+    """
+    计算用例文件与 MedTestlib 下所有源码的哈希，作为执行结果缓存的键
+    :return: 哈希字符串；用例文件不存在时返回None
+    """
+    module_file = os.path.join(project_root, *test_module.split('.')) + '.py'
+    if not os.path.isfile(module_file):
+        return None
+    digest = hashlib.sha256(test_module.encode('utf-8'))
+    with open(module_file, 'rb') as f:
+        digest.update(f.read())
+    lib_dir = os.path.join(project_root, 'MedTestlib')
+    for root, dirs, files in os.walk(lib_dir):
+        dirs[:] = sorted(name for name in dirs if name != '__pycache__')
+        for name in sorted(files):
+            if name.endswith('.py'):
+                path = os.path.join(root, name)
+                digest.update(os.path.relpath(path, lib_dir).encode('utf-8'))
+                with open(path, 'rb') as f:
+                    digest.update(f.read())
+    return digest.hexdigest()
+
+
+def run_test_module(test_module, force=False):
+    """
+    执行QTA用例模块，返回标准输出
+    :param force: 为True时忽略执行结果缓存，强制重新执行（结果仍会写入缓存）
+    """
+    with tracer.span(test_module, kind='qta', force=force) as span:
+        key = hash_sources(test_module) if qta_result_cache_ttl > 0 else None
+        if key is not None and not force:
+            output = qta_result_cache.get(key)
+            if output is not None:
+                span['attributes'].update(cache_hit=True, output_bytes=len(output))
+                return output
+
+        if use_persistent_runner:
+            output, exit_status = qta_worker_pool.run(test_module)
+        else:
+            output, exit_status = run_with_subprocess(test_module, qta_worker_pool.timeout)
+        span['attributes'].update(cache_hit=False, exit_status=exit_status, output_bytes=len(output or ''),
+                                  runner='worker' if use_persistent_runner else 'subprocess')
+        # 超时多由接口或环境引起，不缓存超时结果
+        if key is not None and exit_status != timeout_exit_code:
+            qta_result_cache.set(key, test_module, output)
+        return output
+
+
+def compare_timing(test_module, repeat=5):
+    """
+    对比子进程方式与常驻进程方式执行同一用例的耗时
+    """
+    timings = {'subprocess': [], 'worker': []}
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run_with_subprocess(test_module)
+        timings['subprocess'].append(time.perf_counter() - start)
+    worker = QTATestWorker()
+    for _ in range(repeat):
+        start = time.perf_counter()
+        worker.run(test_module)
+        timings['worker'].append(time.perf_counter() - start)
+    worker.stop()
+    for name, values in timings.items():
+        # 常驻进程的首次执行包含启动开销，单独列出
+        print(f"{name}\tfirst={values[0]:.3f}s\tmean={sum(values) / len(values):.3f}s\t"
+              f"rest_mean={sum(values[1:]) / max(len(values) - 1, 1):.3f}s")
+    return timings
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="对比QTA用例的子进程执行与常驻进程执行耗时")
+    parser.add_argument('test_module', help="用例模块名，如 MedTesttest.test_1")
+    parser.add_argument('--repeat', type=int, default=5, help="每种方式执行的次数")
+    args = parser.parse_args()
+    compare_timing(args.test_module, args.repeat)
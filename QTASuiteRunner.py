@@ -0,0 +1,154 @@
+import argparse
+import csv
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from QTARunner import qta_project_root
+
+case_result_pattern = re.compile(r'^run test case: (\S+)\(pass\?:(True|False)\)', re.M)
+load_failed_pattern = re.compile(r'^load test failed: (\S+)', re.M)
+
+
+def discover_test_modules(project_root=qta_project_root, package='MedTesttest'):
+    """
+    查找用例目录下所有 test_*.py，按编号排序
+    :return: 如 ["MedTesttest.test_1", "MedTesttest.test_2"]
+    """
+    package_dir = os.path.join(project_root, package)
+    names = [name[:-3] for name in os.listdir(package_dir) if name.startswith('test_') and name.endswith('.py')]
+
+    def sort_key(name):
+        suffix = name[len('test_'):]
+        return (0, int(suffix), name) if suffix.isdigit() else (1, 0, name)
+
+    return [f"{package}.{name}" for name in sorted(names, key=sort_key)]
+
+
+def parse_runtest_output(output):
+    """
+    从 manage.py runtest 的输出中解析每个用例的执行结果
+    manage.py 的退出码始终为0，只能根据输出判断是否通过；“load test failed”写在标准错误中，需一并传入
+    :return: (用例结果字典 {用例名: 是否通过}, 加载失败的模块列表)
+    """
+    cases = {name: passed == 'True' for name, passed in case_result_pattern.findall(output)}
+    load_failures = load_failed_pattern.findall(output)
+    return cases, load_failures
+
+
+def run_test_case(test_module, timeout=600, project_root=qta_project_root):
+    """
+    在独立子进程中执行单个用例模块，超时则终止子进程；标准错误合并到输出中，以便记录用例加载失败的原因
+    :return: 执行结果字典，status 为 passed/failed/error/timeout
+    """
+    command = [sys.executable, os.path.join(project_root, 'manage.py'), 'runtest', test_module]
+    start = time.perf_counter()
+    try:
+        result = subprocess.run(command, cwd=project_root, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                text=True, encoding='utf-8', errors='replace', timeout=timeout)
+        output = result.stdout
+        timed_out = False
+    except subprocess.TimeoutExpired as e:
+        output = e.stdout.decode('utf-8', errors='replace') if isinstance(e.stdout, bytes) else (e.stdout or '')
+        timed_out = True
+    duration = time.perf_counter() - start
+
+    cases, load_failures = parse_runtest_output(output)
+    if timed_out:
+        status = 'timeout'
+    elif load_failures or not cases:
+        status = 'error'
+    elif all(cases.values()):
+        status = 'passed'
+    else:
+        status = 'failed'
+    return {
+        'module': test_module,
+        'status': status,
+        'duration': round(duration, 3),
+        'cases': cases,
+        'load_failures': load_failures,
+        'output': output,
+    }
+
+
+def run_suite(test_modules, workers=4, timeout=600, project_root=qta_project_root):
+    """
+    使用线程池并发启动多个用例子进程，用例大部分时间在等待HTTP响应，并发执行可大幅缩短总耗时
+    :param test_modules: 用例模块名列表
+    :param workers: 同时执行的用例进程数
+    :param timeout: 单个用例的超时时间（秒）
+    :return: 按输入顺序排列的执行结果列表
+    """
+    results = {}
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        futures = {executor.submit(run_test_case, module, timeout, project_root): module for module in test_modules}
+        for future in as_completed(futures):
+            module = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                result = {'module': module, 'status': 'error', 'duration': 0.0, 'cases': {}, 'load_failures': [],
+                          'output': f"{type(e).__name__}: {e}"}
+            results[module] = result
+            print(f"[{len(results)}/{len(test_modules)}] {module}\t{result['status']}\t{result['duration']:.2f}s")
+    return [results[module] for module in test_modules]
+
+
+def write_suite_report(results, report_path, wall_time=None):
+    """
+    汇总用例结果，写出JSON报告（含完整输出）与同名CSV摘要
+    :return: 汇总统计
+    """
+    summary = {
+        'total': len(results),
+        'wall_time': round(wall_time, 3) if wall_time is not None else None,
+        'cpu_time': round(sum(result['duration'] for result in results), 3),
+    }
+    for status in ('passed', 'failed', 'error', 'timeout'):
+        summary[status] = sum(1 for result in results if result['status'] == status)
+
+    directory = os.path.dirname(report_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(report_path, 'w', encoding='utf-8') as f:
+        json.dump({'summary': summary, 'results': results}, f, ensure_ascii=False, indent=2)
+    csv_path = os.path.splitext(report_path)[0] + '.csv'
+    with open(csv_path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['module', 'status', 'duration', 'cases', 'load_failures'])
+        for result in results:
+            writer.writerow([result['module'], result['status'], result['duration'],
+                             ';'.join(f"{name}:{'pass' if passed else 'fail'}"
+                                      for name, passed in result['cases'].items()),
+                             ';'.join(result['load_failures'])])
+    return summary
+
+
+def print_suite_summary(results, summary):
+    print("\n========== 用例执行汇总 ==========")
+    for result in results:
+        print(f"{result['module']}\t{result['status']}\t{result['duration']:.2f}s")
+    print(f"共{summary['total']}个: 通过{summary['passed']}，失败{summary['failed']}，"
+          f"错误{summary['error']}，超时{summary['timeout']}；"
+          f"总耗时{summary['wall_time']}s，累计用例耗时{summary['cpu_time']}s")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="并发执行 medtesttestproj 下生成的测试用例")
+    parser.add_argument('tests', nargs='*', help="用例模块名，如 MedTesttest.test_1；默认执行 MedTesttest 下所有 test_*.py")
+    parser.add_argument('--workers', type=int, default=8, help="同时执行的用例进程数")
+    parser.add_argument('--timeout', type=float, default=600, help="单个用例的超时时间（秒）")
+    parser.add_argument('--report', default=os.path.join(qta_project_root, 'suite_report.json'),
+                        help="结果报告路径，同时生成同名CSV")
+    args = parser.parse_args()
+
+    test_modules = args.tests or discover_test_modules()
+    start = time.perf_counter()
+    suite_results = run_suite(test_modules, args.workers, args.timeout)
+    suite_summary = write_suite_report(suite_results, args.report, time.perf_counter() - start)
+    print_suite_summary(suite_results, suite_summary)
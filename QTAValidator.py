@@ -0,0 +1,119 @@
+import argparse
+import ast
+import os
+import sys
+from importlib.machinery import PathFinder
+
+from QTARunner import qta_project_root
+
+# 写入前的静态检查：QTA_PREFLIGHT=0 时直接写入LLM输出（原有行为）
+preflight_enabled = os.getenv("QTA_PREFLIGHT", "1") not in ("", "0")
+required_attributes = ['owner', 'timeout', 'priority', 'status']
+
+
+def base_name(node):
+    if isinstance(node, ast.Attribute):
+        return node.attr
+    if isinstance(node, ast.Name):
+        return node.id
+    return None
+
+
+def module_exists(name, search_path=None):
+    """
+    只查找模块文件而不导入，避免执行被检查代码所引用模块的初始化逻辑。
+    非包模块下的“子模块”（如 os.path）是模块导入时才设置的属性，无法在不导入的情况下检查，视为存在
+    :param name: 点分模块名，如 testbase.testcase
+    """
+    search_path = search_path or [qta_project_root] + sys.path
+    parts = name.split('.')
+    if parts[0] in sys.builtin_module_names:
+        return True
+    spec = PathFinder.find_spec(parts[0], search_path)
+    for index in range(1, len(parts)):
+        if spec is None:
+            return False
+        if not spec.submodule_search_locations:
+            return True
+        spec = PathFinder.find_spec('.'.join(parts[:index + 1]), spec.submodule_search_locations)
+    return spec is not None
+
+
+def check_test_class(cls):
+    """
+    :return: 该用例类缺少的QTA结构
+    """
+    assigned = set()
+    methods = set()
+    for node in cls.body:
+        if isinstance(node, ast.Assign):
+            assigned.update(target.id for target in node.targets if isinstance(target, ast.Name))
+        elif isinstance(node, ast.AnnAssign) and isinstance(node.target, ast.Name):
+            assigned.add(node.target.id)
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            methods.add(node.name)
+    errors = [f"用例类 {cls.name} 缺少类属性 {name}" for name in required_attributes if name not in assigned]
+    if 'run_test' not in methods:
+        errors.append(f"用例类 {cls.name} 缺少 run_test 方法")
+    return errors
+
+
+def validate_test_code(code, search_path=None):
+    """
+    在写入文件和执行之前检查生成的QTA测试用例代码：能否编译、是否有含 owner/timeout/priority/status/run_test 的
+    TestCase 子类、导入的模块能否找到
+    :return: 错误信息列表，为空表示通过
+    """
+    if not code or not code.strip() or code.strip() == "没有找到代码块":
+        return ["LLM输出中没有找到```python代码块"]
+    try:
+        tree = compile(code, '<generated>', 'exec', ast.PyCF_ONLY_AST)
+    except SyntaxError as e:
+        return [f"语法错误: 第{e.lineno}行 {e.msg}: {(e.text or '').strip()}"]
+
+    errors = []
+    test_classes = [node for node in ast.walk(tree) if isinstance(node, ast.ClassDef)
+                    and any((base_name(base) or '').endswith('TestCase') for base in node.bases)]
+    if not test_classes:
+        errors.append("没有继承 TestCase 的用例类")
+    for cls in test_classes:
+        errors.extend(check_test_class(cls))
+
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names = [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            names = [node.module]
+        else:
+            continue
+        errors.extend(f"第{node.lineno}行导入的模块 {name} 不存在" for name in names
+                      if not module_exists(name, search_path))
+    return errors
+
+
+def preflight_message(code, path):
+    """
+    :return: 未通过检查时返回给Agent的说明，通过或检查关闭时返回None
+    """
+    if not preflight_enabled:
+        return None
+    errors = validate_test_code(code)
+    if not errors:
+        return None
+    return (f"生成的测试用例未通过静态检查，未写入 {path}（原文件保持不变），请重试：\n"
+            + '\n'.join(f"- {error}" for error in errors))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="静态检查QTA测试用例文件的语法、用例结构与导入")
+    parser.add_argument('paths', nargs='+', help="QTA测试用例文件")
+    args = parser.parse_args()
+    failed = 0
+    for test_path in args.paths:
+        with open(test_path, 'r', encoding='utf-8') as f:
+            problems = validate_test_code(f.read())
+        failed += bool(problems)
+        print(f"{test_path}: {'通过' if not problems else '未通过'}")
+        for problem in problems:
+            print(f"  - {problem}")
+    sys.exit(1 if failed else 0)
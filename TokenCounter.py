@@ -0,0 +1,23 @@
+try:
+    import tiktoken  # 可选依赖，安装后用于精确计算token数
+except ImportError:
+    tiktoken = None
+
+_token_encoder = None
+
+
+def estimate_tokens(text):
+    """
+    本地估算文本的token数，不请求接口
+    安装tiktoken时按gpt-4o的编码精确计算，否则按中日韩字符每字1个token、其余字符每4个1个token估算
+    """
+    global _token_encoder
+    if tiktoken is not None and _token_encoder is None:
+        try:
+            _token_encoder = tiktoken.get_encoding("o200k_base")
+        except Exception:
+            _token_encoder = False  # 编码文件无法加载时退回估算
+    if _token_encoder:
+        return len(_token_encoder.encode(text))
+    cjk = sum(1 for char in text if '\u2e80' <= char <= '\u9fff' or '\uff00' <= char <= '\uffef')
+    return cjk + (len(text) - cjk + 3) // 4
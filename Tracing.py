@@ -0,0 +1,173 @@
+import argparse
+import contextvars
+import json
+import os
+import threading
+import time
+import uuid
+from collections import defaultdict
+from contextlib import contextmanager
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+default_trace_dir = os.getenv("TRACE_DIR", "traces")
+
+# 当前数据集与当前span通过contextvars传递；线程池中执行的任务需用 contextvars.copy_context().run 继承
+current_dataset = contextvars.ContextVar('trace_dataset', default=None)
+current_span = contextvars.ContextVar('trace_span', default=None)
+
+
+class Tracer:
+    """
+    结构化的流水线追踪：每个阶段、工具调用、LLM请求和用例执行记录为一个span，
+    含耗时、状态和提示词字节数、token用量、缓存命中、退出码等属性，按数据集写入 <TRACE_DIR>/<数据集>.jsonl
+    """
+
+    def __init__(self, directory=default_trace_dir, enabled=None):
+        """
+        :param directory: JSON Lines输出目录
+        :param enabled: 是否记录，默认读取环境变量 TRACE_ENABLED（设为0关闭）
+        """
+        self.directory = directory
+        if enabled is None:
+            enabled = os.getenv("TRACE_ENABLED", "1") not in ("", "0")
+        self.enabled = enabled
+        self.lock = threading.Lock()
+
+    def path(self, dataset):
+        return os.path.join(self.directory, f"{dataset or 'global'}.jsonl")
+
+    def emit(self, record):
+        if not self.enabled:
+            return
+        line = json.dumps(record, ensure_ascii=False, default=str) + '\n'
+        with self.lock:
+            os.makedirs(self.directory, exist_ok=True)
+            # 追加模式下单行写入是原子的，清洗阶段的多个进程可以写同一个文件
+            with open(self.path(record['dataset']), 'a', encoding='utf-8') as f:
+                f.write(line)
+
+    @contextmanager
+    def dataset(self, name):
+        """
+        在该上下文中产生的span都写入指定数据集的文件
+        """
+        token = current_dataset.set(str(name))
+        try:
+            yield
+        finally:
+            current_dataset.reset(token)
+
+    def start_span(self, name, kind='stage', **attributes):
+        """
+        开始一个span，供无法使用with语句的回调使用，需与 end_span 成对调用
+        """
+        parent = current_span.get()
+        return {
+            'dataset': current_dataset.get(),
+            'span_id': uuid.uuid4().hex[:16],
+            'parent_id': parent['span_id'] if parent else None,
+            'name': name,
+            'kind': kind,
+            'start': time.time(),
+            'perf_start': time.perf_counter(),
+            'attributes': dict(attributes),
+        }
+
+    def end_span(self, span, status='ok', error=None, **attributes):
+        span['attributes'].update(attributes)
+        record = {key: value for key, value in span.items() if key != 'perf_start'}
+        record['duration'] = round(time.perf_counter() - span['perf_start'], 6)
+        record['status'] = status
+        if error is not None:
+            record['error'] = f"{type(error).__name__}: {error}" if isinstance(error, BaseException) else str(error)
+        self.emit(record)
+        return record
+
+    @contextmanager
+    def span(self, name, kind='stage', **attributes):
+        """
+        with tracer.span("step_1", urls=10) as span:
+            span['attributes']['rows'] = 100
+        其中抛出的异常记为status=error后继续向外抛出
+        """
+        span = self.start_span(name, kind, **attributes)
+        token = current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            current_span.reset(token)
+            self.end_span(span, 'error', e)
+            raise
+        current_span.reset(token)
+        self.end_span(span)
+
+
+tracer = Tracer()
+
+
+class ToolTracingCallback(BaseCallbackHandler):
+    """
+    通过 invoke 的 config 传给AgentExecutor，把每次 @tool 调用记录为kind=tool的span，
+    工具内部的LLM请求与用例执行记录为它的子span
+    """
+
+    def __init__(self, tracer=tracer):
+        self.tracer = tracer
+        self.started = {}
+
+    def on_tool_start(self, serialized, input_str, *, run_id, **kwargs):
+        span = self.tracer.start_span(serialized.get('name', 'tool'), kind='tool',
+                                      input_bytes=len(str(input_str).encode('utf-8')))
+        self.started[run_id] = (span, current_span.get())
+        current_span.set(span)
+
+    def finish(self, run_id, status, error=None, **attributes):
+        started = self.started.pop(run_id, None)
+        if started is None:
+            return
+        span, parent = started
+        current_span.set(parent)
+        self.tracer.end_span(span, status, error, **attributes)
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        self.finish(run_id, 'ok', output_bytes=len(str(output).encode('utf-8')))
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        self.finish(run_id, 'error', error)
+
+
+def summarize(path):
+    """
+    按 kind/name 汇总一个追踪文件中的span
+    :return: {(kind, name): 统计}
+    """
+    summary = defaultdict(lambda: {'count': 0, 'errors': 0, 'seconds': 0.0, 'prompt_bytes': 0,
+                                   'prompt_tokens': 0, 'completion_tokens': 0, 'cache_hits': 0})
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            record = json.loads(line)
+            attributes = record.get('attributes', {})
+            entry = summary[(record['kind'], record['name'])]
+            entry['count'] += 1
+            entry['errors'] += int(record['status'] != 'ok')
+            entry['seconds'] += record['duration']
+            entry['prompt_bytes'] += attributes.get('prompt_bytes') or 0
+            entry['prompt_tokens'] += attributes.get('prompt_tokens') or 0
+            entry['completion_tokens'] += attributes.get('completion_tokens') or 0
+            entry['cache_hits'] += int(bool(attributes.get('cache_hit')))
+    return summary
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="汇总追踪文件中各阶段、工具与LLM调用的耗时和token用量")
+    parser.add_argument('paths', nargs='+', help="追踪文件，如 traces/1.jsonl")
+    args = parser.parse_args()
+    for trace_path in args.paths:
+        print(f"== {trace_path}")
+        print("kind\tname\tcount\terrors\tseconds\tprompt_bytes\tprompt_tokens\tcompletion_tokens\tcache_hits")
+        rows = sorted(summarize(trace_path).items(), key=lambda item: -item[1]['seconds'])
+        for (kind, name), entry in rows:
+            print(f"{kind}\t{name}\t{entry['count']}\t{entry['errors']}\t{entry['seconds']:.3f}\t"
+                  f"{entry['prompt_bytes']}\t{entry['prompt_tokens']}\t{entry['completion_tokens']}\t"
+                  f"{entry['cache_hits']}")